@@ -0,0 +1,89 @@
+"""
+Chunker throughput and chunk sizes over the scraped corpus.
+
+Run from backend/:
+
+    python benchmarks/chunker.py [--input parsing-python/nmbu/nmbu_data.json]
+
+Streams every document through chunking.chunk_text and through the old
+300-character paragraph packer, and reports documents and MB per second,
+chunk counts and token-size distribution for both.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# embedding_db builds its OpenAI client at import; it is never called here.
+os.environ.setdefault("OPENAI_API_KEY", "unused")
+
+import chunking
+import embedding_db
+
+
+def legacy_chunks(text: str, max_size: int = 300):
+    chunks = []
+    buffer = ""
+
+    for para in (p.strip() for p in re.split(r"\n\s*\n+", text) if p.strip()):
+        if len(buffer) + len(para) <= max_size:
+            buffer += ("\n\n" if buffer else "") + para
+        else:
+            if buffer:
+                chunks.append(buffer.strip())
+            buffer = para
+
+    if buffer:
+        chunks.append(buffer.strip())
+
+    return chunks
+
+
+def run(name: str, chunker, path: str):
+    docs = 0
+    chars = 0
+    chunks = []
+
+    start = time.perf_counter()
+
+    for item in embedding_db.iter_documents(path):
+        text = item.get("text", "")
+        docs += 1
+        chars += len(text)
+
+        for chunk in chunker(text):
+            chunks.append(chunk)
+
+    elapsed = time.perf_counter() - start
+
+    # Counted afterwards so the legacy timing is not charged for tokenizing.
+    tokens = np.array([chunking.count_tokens(c) for c in chunks]) if chunks else np.zeros(1)
+
+    print(
+        f"{name:>8}: {docs / elapsed:8.0f} docs/s | {chars / elapsed / 1e6:6.2f} MB/s "
+        f"| {len(chunks)} chunks "
+        f"| tokens p50 {np.median(tokens):.0f} p95 {np.percentile(tokens, 95):.0f} "
+        f"max {tokens.max():.0f} "
+        f"| over {embedding_db.EMBED_MAX_INPUT_TOKENS}: {(tokens > embedding_db.EMBED_MAX_INPUT_TOKENS).sum()}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", default="parsing-python/nmbu/nmbu_data.json")
+    args = parser.parse_args()
+
+    # Load the encoding up front so it is not part of the first timing.
+    chunking.get_encoding()
+
+    run("legacy", legacy_chunks, args.input)
+    run("tokens", chunking.chunk_text, args.input)
+
+
+if __name__ == "__main__":
+    main()
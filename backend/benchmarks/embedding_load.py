@@ -0,0 +1,114 @@
+"""
+Loading embedding rows: executemany vs. binary COPY + merge.
+
+Run from backend/ against a scratch Postgres with pgvector:
+
+    DATABASE_URL=postgresql://... python benchmarks/embedding_load.py [--rows 20000]
+
+Both paths write random 1536-dimensional vectors into a TEMP table shaped
+like embeddings, so nothing outside the session is touched and no OpenAI
+calls are made.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import psycopg
+from pgvector.psycopg import register_vector
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# embedding_db builds its OpenAI client at import; it is never called here.
+os.environ.setdefault("OPENAI_API_KEY", "unused")
+
+import embedding_db
+import vectors
+
+
+TABLE = "bench_embeddings"
+
+
+def make_rows(n: int, dims: int, text_chars: int) -> list:
+    rng = np.random.default_rng(0)
+    matrix = rng.standard_normal((n, dims), dtype=np.float32)
+    text = "x" * text_chars
+
+    return [
+        (f"https://example.org/{i}", f"Side {i}", text, matrix[i], f"{i:064x}", "bench")
+        for i in range(n)
+    ]
+
+
+def reset(conn, dims: int):
+    conn.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    conn.execute(
+        f"""
+        CREATE TEMP TABLE {TABLE} (
+            id bigserial PRIMARY KEY,
+            url text,
+            title text,
+            text text,
+            embedding {vectors.EMBEDDING_STORAGE}({dims}),
+            content_hash text,
+            last_seen_run text
+        )
+        """
+    )
+    conn.execute(f"CREATE INDEX ON {TABLE} (content_hash)")
+    conn.commit()
+
+
+def measure(conn, load, rows: list, batch: int, dims: int) -> float:
+    reset(conn, dims)
+
+    start = time.perf_counter()
+    for i in range(0, len(rows), batch):
+        load(conn, rows[i:i + batch], TABLE)
+    elapsed = time.perf_counter() - start
+
+    count = conn.execute(f"SELECT count(*) FROM {TABLE}").fetchone()[0]
+    assert count == len(rows), (count, len(rows))
+
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--dims", type=int, default=1536)
+    parser.add_argument("--batch", type=int, default=embedding_db.COPY_BATCH)
+    parser.add_argument("--text-chars", type=int, default=1200)
+    args = parser.parse_args()
+
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        raise ValueError("Missing DATABASE_URL")
+
+    rows = make_rows(args.rows, args.dims, args.text_chars)
+
+    modes = [
+        ("executemany", embedding_db.store_embeddings),
+        ("copy", embedding_db.copy_embeddings),
+    ]
+
+    with psycopg.connect(url) as conn:
+        register_vector(conn)
+
+        baseline = None
+
+        for name, load in modes:
+            elapsed = measure(conn, load, rows, args.batch, args.dims)
+            rate = args.rows / elapsed
+            baseline = baseline or rate
+
+            print(
+                f"{name:>11}: {elapsed:7.2f} s "
+                f"| {rate:9.0f} rows/s "
+                f"| x{rate / baseline:.1f} vs executemany"
+            )
+
+
+if __name__ == "__main__":
+    main()
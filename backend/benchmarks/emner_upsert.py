@@ -0,0 +1,121 @@
+"""
+Writing emner results: one upsert + commit per course vs. batched upserts.
+
+Run from backend/ against a scratch Postgres that has the emner table:
+
+    DATABASE_URL=postgresql://... python benchmarks/emner_upsert.py [--rows 3000]
+
+Both paths write synthetic courses into a TEMP copy of emner (LIKE emner
+INCLUDING ALL), so the real table is never touched and no OpenAI calls are
+made. The pending lookup is timed the same way: one done_codes() query
+against one SELECT per course.
+"""
+import argparse
+import os
+import sys
+import time
+
+import psycopg
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# populate_db requires both at import; OpenAI is never called here.
+os.environ.setdefault("OPENAI_API_KEY", "unused")
+
+import populate_db
+
+
+TABLE = "bench_emner"
+
+
+def make_rows(n: int) -> list:
+    text = "Emnet gir en innføring i faget. " * 20
+
+    return [
+        {
+            "emnekode": f"BENCH{i:05d}",
+            "navn": f"Emne {i}",
+            "studiepoeng": 5.0,
+            "semester": "Høst",
+            "fakultet": "Fakultet for realfag og teknologi",
+            "underviser": "Ola Nordmann",
+            "språk": "Norsk",
+            "antall_plasser": 40,
+            "dette_lærer_du": text,
+            "forkunnskaper": text,
+            "læringsaktiviteter": text,
+            "vurderingsordning": text,
+            "obligatoriske_aktiviteter": text,
+            "merknader": None,
+            "fortrinnsrett": None,
+        }
+        for i in range(n)
+    ]
+
+
+def reset(conn):
+    conn.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    conn.execute(f"CREATE TEMP TABLE {TABLE} (LIKE emner INCLUDING ALL)")
+    conn.commit()
+
+
+def per_row(conn, rows: list, batch: int):
+    for data in rows:
+        populate_db.update_emne(conn, data, TABLE)
+        conn.commit()
+
+
+def batched(conn, rows: list, batch: int):
+    for i in range(0, len(rows), batch):
+        populate_db.upsert_emner(conn, rows[i:i + batch], TABLE)
+        conn.commit()
+
+
+def lookup(conn, codes: list) -> float:
+    start = time.perf_counter()
+    with conn.cursor() as cur:
+        for code in codes:
+            cur.execute(f"SELECT processed_at FROM {TABLE} WHERE emnekode = %s", (code,))
+            cur.fetchone()
+    per_course = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT emnekode FROM {TABLE} WHERE processed_at IS NOT NULL")
+        cur.fetchall()
+    bulk = time.perf_counter() - start
+
+    return per_course, bulk
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=3000)
+    parser.add_argument("--batch", type=int, default=populate_db.UPSERT_BATCH)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+
+    with psycopg.connect(populate_db.DATABASE_URL) as conn:
+
+        baseline = None
+
+        for name, write in (("per-row", per_row), ("batched", batched)):
+            reset(conn)
+
+            start = time.perf_counter()
+            write(conn, rows, args.batch)
+            elapsed = time.perf_counter() - start
+
+            count = conn.execute(f"SELECT count(*) FROM {TABLE}").fetchone()[0]
+            assert count == len(rows), (count, len(rows))
+
+            baseline = baseline or elapsed
+            print(f"{name:>8}: {elapsed:7.2f} s | x{baseline / elapsed:.1f} vs per-row")
+
+        per_course, bulk = lookup(conn, [r["emnekode"] for r in rows])
+        print(f"  lookup: {per_course * 1000:7.1f} ms per-course | {bulk * 1000:.1f} ms bulk")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+match_emne with the NameIndex against the full SequenceMatcher scan, and
+the cross-year match table against matching every year from scratch.
+
+Run from backend/:
+
+    python benchmarks/grade_matching.py [--sheet 2024] [--names 2016,2020] [--limit 400]
+        [--years 2016,...,2024]
+
+No database is needed: the course names from the --names sheets stand in
+for the emner table, which is what they are matched against in practice.
+Both matchers run over the same names; the scan only over the first
+--limit of them, since it is the slow one. Reports ms per course for each
+and checks that every match at MATCH_THRESHOLD (row and score) is
+identical.
+
+The second part runs match_sheet over --years in order with an in-memory
+match table, as main() does with emnenavn_match, and checks each year's
+result rows against per-course match_emne. The third renames one course
+and matches the last year again against the same table: only the names
+near it should be re-matched, with the same result as from scratch.
+Exits non-zero on any difference.
+"""
+import argparse
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "parsing-python"))
+
+# combine_grading requires it at import; the database is never used here.
+os.environ.setdefault("DATABASE_URL", "unused")
+
+import combine_grading
+
+
+def sheet(year: str) -> str:
+    return os.path.join(combine_grading.GRADES_DIR, f"Karakterfordeling_{year}.xlsx")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sheet", default="2024")
+    parser.add_argument("--names", default="2016,2020")
+    parser.add_argument("--limit", type=int, default=400)
+    parser.add_argument("--years", default=",".join(str(y) for y in range(2016, 2025)))
+    args = parser.parse_args()
+
+    rows = combine_grading.parse_excel(sheet(args.sheet))
+
+    emner = [
+        {"emnekode": f"{year}:{i}", "navn": r["raw_name"], "norm": r["norm"]}
+        for year in args.names.split(",")
+        for i, r in enumerate(combine_grading.parse_excel(sheet(year)))
+    ]
+
+    print(f"{len(rows)} rader i {args.sheet}, {len(emner)} navn fra {args.names}")
+
+    start = time.perf_counter()
+    index = combine_grading.NameIndex(rows)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexed = [combine_grading.match_emne(e, index) for e in emner]
+    indexed_time = time.perf_counter() - start
+
+    candidates = sum(len(index.candidates(e["norm"])) for e in emner) / max(len(emner), 1)
+
+    sample = emner[:args.limit]
+
+    start = time.perf_counter()
+    scanned = [combine_grading.match_emne_scan(e, rows) for e in sample]
+    scan_time = time.perf_counter() - start
+
+    per_indexed = indexed_time / len(emner) * 1000
+    per_scan = scan_time / len(sample) * 1000
+
+    print(f"   scan: {per_scan:8.3f} ms/emne ({len(sample)} emner)")
+    print(
+        f"  index: {per_indexed:8.3f} ms/emne ({len(emner)} emner, "
+        f"bygget på {build * 1000:.1f} ms, {candidates:.1f} kandidater/emne)"
+    )
+    print(f"speedup: x{per_scan / per_indexed:.0f}")
+
+    mismatches = 0
+
+    for e, (old, old_score), (new, new_score) in zip(sample, scanned, indexed):
+        if old is new and (old is None or old_score == new_score):
+            continue
+
+        mismatches += 1
+
+        if mismatches <= 10:
+            print(
+                f"MISMATCH {e['navn']!r}: "
+                f"scan={old and old['raw_name']!r} ({old_score:.3f}) "
+                f"index={new and new['raw_name']!r} ({new_score:.3f})"
+            )
+
+    matched = sum(1 for m, _ in scanned if m is not None)
+    print(f"parity: {len(sample) - mismatches}/{len(sample)} identical ({matched} matches)")
+
+    emne_index = combine_grading.NameIndex(emner)
+    known = {}
+
+    def run_year(year: str, emner: list, emne_index) -> bool:
+        year_rows = combine_grading.parse_excel(sheet(year))
+
+        start = time.perf_counter()
+        result, new = combine_grading.match_sheet(
+            year_rows, int(year), emner, emne_index, known, year
+        )
+        elapsed = time.perf_counter() - start
+
+        for entry in new:
+            known[entry["norm"]] = entry
+
+        sheet_index = combine_grading.NameIndex(year_rows)
+        expected = {}
+
+        for e in emner:
+            match, _ = combine_grading.match_emne(e, sheet_index)
+            if match:
+                expected[e["emnekode"]] = combine_grading.result_row(e, int(year), match)
+
+        same = expected == {r["emnekode"]: r for r in result}
+
+        print(
+            f"{year}: {elapsed * 1000:7.1f} ms | {len(new):4d} nye navn | "
+            f"{len(result)} rader | {'identisk' if same else 'AVVIK'}"
+        )
+
+        return same
+
+    years = args.years.split(",")
+
+    for year in years:
+        mismatches += not run_year(year, emner, emne_index)
+
+    # A course renamed to a name from the last sheet, as a populate_db run
+    # might do: it should pull in exactly the names close to it.
+    last_rows = combine_grading.parse_excel(sheet(years[-1]))
+    renamed = [dict(e) for e in emner]
+    renamed[0]["norm"] = last_rows[len(last_rows) // 2]["norm"]
+
+    print(f"omdøpt {renamed[0]['emnekode']} til {renamed[0]['norm']!r}:")
+    mismatches += not run_year(years[-1], renamed, combine_grading.NameIndex(renamed))
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
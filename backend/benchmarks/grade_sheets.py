@@ -0,0 +1,102 @@
+"""
+Parsing grade workbooks: pd.read_excel + iterrows against the cached
+columnar parse.
+
+Run from backend/:
+
+    python benchmarks/grade_sheets.py
+
+For every workbook in parsing-python/grades it times parse_excel_pandas,
+a cold parse_excel (openpyxl read-only, written to an empty temporary
+cache) and a warm parse_excel (read back from that cache), and checks
+that all three give the same rows. Exits non-zero on any difference.
+"""
+import math
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "parsing-python"))
+
+# combine_grading requires it at import; the database is never used here.
+os.environ.setdefault("DATABASE_URL", "unused")
+
+import combine_grading
+
+
+def timed(fn, path: str) -> tuple:
+    start = time.perf_counter()
+    rows = fn(path)
+    return rows, (time.perf_counter() - start) * 1000
+
+
+def same(a: list, b: list) -> bool:
+    if len(a) != len(b):
+        return False
+
+    for x, y in zip(a, b):
+        for key, value in x.items():
+            other = y[key]
+
+            # Empty cells are NaN in both.
+            if isinstance(value, float) and isinstance(other, float):
+                if math.isnan(value) and math.isnan(other):
+                    continue
+
+            if value != other:
+                return False
+
+    return True
+
+
+def main():
+    files = sorted(
+        os.path.join(combine_grading.GRADES_DIR, f)
+        for f in os.listdir(combine_grading.GRADES_DIR)
+        if f.endswith(".xlsx")
+    )
+
+    totals = [0.0, 0.0, 0.0]
+    mismatches = 0
+
+    with tempfile.TemporaryDirectory() as cache:
+        combine_grading.SHEET_CACHE_DIR = cache
+
+        for path in files:
+            name = os.path.basename(path)
+
+            try:
+                expected, pandas_ms = timed(combine_grading.parse_excel_pandas, path)
+            except Exception as e:
+                print(f"{name}: hoppet over ({e})")
+                continue
+
+            cold, cold_ms = timed(combine_grading.parse_excel, path)
+            warm, warm_ms = timed(combine_grading.parse_excel, path)
+
+            ok = same(expected, cold) and same(expected, warm)
+            mismatches += not ok
+
+            for i, ms in enumerate((pandas_ms, cold_ms, warm_ms)):
+                totals[i] += ms
+
+            print(
+                f"{name}: pandas {pandas_ms:6.1f} ms | kald {cold_ms:6.1f} ms | "
+                f"cache {warm_ms:5.1f} ms | {len(expected)} rader | "
+                f"{'identisk' if ok else 'AVVIK'}"
+            )
+
+    print(
+        f"totalt: pandas {totals[0]:.0f} ms | kald {totals[1]:.0f} ms | "
+        f"cache {totals[2]:.0f} ms"
+    )
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
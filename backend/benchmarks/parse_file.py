@@ -0,0 +1,81 @@
+"""
+Single-pass parse_file against the FIELDS regex version.
+
+Run from backend/:
+
+    python benchmarks/parse_file.py [--folder parsing-python/subject_contents]
+
+Parses every course page with both parsers, reports ms per file for each,
+and compares the results field by field. Exits non-zero on any mismatch,
+so it doubles as the parity check when FIELDS or the section table change.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# populate_db requires both at import; neither is used here.
+os.environ.setdefault("DATABASE_URL", "unused")
+os.environ.setdefault("OPENAI_API_KEY", "unused")
+
+import populate_db
+
+
+def timed(parser, files: list) -> tuple:
+    start = time.perf_counter()
+    results = [parser(f) for f in files]
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--folder", default=populate_db.SUBJECT_FOLDER)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    files = sorted(
+        os.path.join(args.folder, f)
+        for f in os.listdir(args.folder)
+        if f.endswith(".txt")
+    )
+
+    # Warm the page cache so both parsers read from memory.
+    for f in files:
+        with open(f, "rb") as fh:
+            fh.read()
+
+    best = {}
+
+    for name, fn in (("regex", populate_db.parse_file_regex), ("single", populate_db.parse_file)):
+        times = []
+        for _ in range(args.rounds):
+            results, elapsed = timed(fn, files)
+            times.append(elapsed)
+        best[name] = (results, min(times))
+
+        print(f"{name:>7}: {min(times) / len(files) * 1000:7.3f} ms/file ({len(files)} files)")
+
+    print(f"speedup: x{best['regex'][1] / best['single'][1]:.1f}")
+
+    mismatches = 0
+
+    for f, old, new in zip(files, best["regex"][0], best["single"][0]):
+        if old == new:
+            continue
+
+        mismatches += 1
+
+        if mismatches <= 10:
+            fields = [k for k in old if old[k] != new.get(k)]
+            print(f"MISMATCH {os.path.basename(f)}: {', '.join(fields)}")
+
+    print(f"parity: {len(files) - mismatches}/{len(files)} identical")
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
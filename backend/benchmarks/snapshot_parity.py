@@ -0,0 +1,123 @@
+"""
+API responses served from Postgres against the same responses served from
+a snapshot.
+
+Run from backend/:
+
+    DATABASE_URL=postgresql://... python benchmarks/snapshot_parity.py [--sample 200]
+
+Exports a snapshot of the database to a temporary directory, then starts
+main.py twice in fresh processes, once without SNAPSHOT_DIR and once with
+it pointing at the export, and requests /api/courses plus /api/course and
+/api/grades for --sample courses and grade rows. Every response body must
+decode to the same JSON. Exits non-zero on any difference.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import psycopg
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+CHILD = """
+import json, sys
+import main
+from fastapi.testclient import TestClient
+paths = json.loads(sys.argv[1])
+with TestClient(main.app) as client:
+    out = {}
+    for path in paths:
+        r = client.get(path)
+        out[path] = [r.status_code, r.json()]
+print(json.dumps(out))
+"""
+
+
+def fetch(paths: list, snapshot_dir: str = None) -> dict:
+    env = dict(os.environ)
+    env.pop("SNAPSHOT_DIR", None)
+
+    if snapshot_dir:
+        env["SNAPSHOT_DIR"] = snapshot_dir
+
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD, json.dumps(paths)],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def by_code(body: dict) -> dict:
+    """/api/courses in emnekode order; Postgres returns it unordered."""
+    return {**body, "data": sorted(body["data"], key=lambda r: r["emnekode"])}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sample", type=int, default=200)
+    args = parser.parse_args()
+
+    database_url = os.getenv("DATABASE_URL")
+
+    if not database_url:
+        raise ValueError("Missing DATABASE_URL")
+
+    with psycopg.connect(database_url) as conn, conn.cursor() as cur:
+        cur.execute("SELECT emnekode FROM emner ORDER BY emnekode LIMIT %s", (args.sample,))
+        codes = [r[0] for r in cur.fetchall()]
+
+        cur.execute(
+            "SELECT emnekode, ar FROM eksamensresultater ORDER BY emnekode, ar LIMIT %s",
+            (args.sample,),
+        )
+        grades = cur.fetchall()
+
+    paths = ["/api/courses"]
+    paths += [f"/api/course/{code}" for code in codes]
+    paths += [f"/api/grades?emnekode={code}&year={ar}" for code, ar in grades]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        export = os.path.join(tmp, "snapshot")
+
+        subprocess.run(
+            [sys.executable, "snapshot.py", "export", export],
+            cwd=BACKEND_DIR,
+            check=True,
+        )
+
+        expected = fetch(paths)
+        actual = fetch(paths, export)
+
+    expected["/api/courses"][1] = by_code(expected["/api/courses"][1])
+    actual["/api/courses"][1] = by_code(actual["/api/courses"][1])
+
+    mismatches = 0
+
+    for path in paths:
+        if expected[path] == actual[path]:
+            continue
+
+        mismatches += 1
+
+        if mismatches <= 10:
+            print(f"AVVIK {path}:\n  postgres: {expected[path]}\n  snapshot: {actual[path]}"[:2000])
+
+    print(f"parity: {len(paths) - mismatches}/{len(paths)} identiske svar")
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
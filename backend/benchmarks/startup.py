@@ -0,0 +1,88 @@
+"""
+Startup-time benchmark for the API process.
+
+Run from backend/:
+
+    python benchmarks/startup.py [--runs 5]
+
+Measures the import of main.py and the time until /health/live answers
+in a fresh process, and checks that the API does not pull in any of the
+ingestion-only dependencies. Point DATABASE_URL at a slow or unreachable
+database to check that it does not block startup.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+INGEST_ONLY = ["pandas", "scipy", "matplotlib", "pypdf", "scrapy", "openpyxl", "bs4"]
+
+
+CHILD = """
+import json, sys, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    t2 = time.perf_counter()
+    status = client.get("/health/live").status_code
+    t3 = time.perf_counter()
+heavy = [m for m in %r if m in sys.modules]
+print(json.dumps({
+    "import": t1 - t0,
+    "lifespan": t2 - t1,
+    "live": t3 - t2,
+    "status": status,
+    "heavy": heavy,
+}))
+"""
+
+
+def run_once():
+
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD % INGEST_ONLY],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    results = [run_once() for _ in range(args.runs)]
+
+    for key in ("import", "lifespan", "live"):
+        values = [r[key] * 1000 for r in results]
+        print(
+            f"{key:>8}: median {statistics.median(values):7.1f} ms "
+            f"| min {min(values):7.1f} ms | max {max(values):7.1f} ms"
+        )
+
+    total = [sum(r[k] for k in ("import", "lifespan", "live")) * 1000 for r in results]
+    print(f"   total: median {statistics.median(total):7.1f} ms to first liveness response")
+
+    heavy = sorted({m for r in results for m in r["heavy"]})
+
+    if heavy:
+        print(f"WARNING: the API imports ingestion dependencies: {', '.join(heavy)}")
+        sys.exit(1)
+
+    print("OK: no ingestion dependencies in the API import graph")
+
+
+if __name__ == "__main__":
+    main()
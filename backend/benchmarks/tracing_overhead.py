@@ -0,0 +1,103 @@
+"""
+Overhead of tracing.span() on a chat-pipeline shaped request.
+
+Run from backend/:
+
+    python benchmarks/tracing_overhead.py [--requests 20000]
+
+Each simulated request opens the same 11 nested spans as query.get_answer,
+with no real work inside, so the numbers are pure tracing cost. Modes:
+disabled (no exporter), an in-memory exporter, and the JSONL exporter
+writing to a temp file.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tracing
+
+
+class MemoryExporter:
+
+    def __init__(self):
+        self.count = 0
+
+    def export(self, spans):
+        self.count += len(spans)
+
+
+def fake_request():
+    with tracing.span("get_answer", question_chars=42) as root:
+        with tracing.span("build_context") as sp:
+            with tracing.span("extract_emnekoder"):
+                pass
+            with tracing.span("extract_study_mentions"):
+                pass
+            with tracing.span("classify_intent") as c:
+                c.set("intent", "exam_rules_general")
+            with tracing.span("fetch_rules_context"):
+                with tracing.span("embed_query", model="text-embedding-3-small"):
+                    pass
+                with tracing.span("match_embeddings", limit=10) as m:
+                    m.set("matches", 10)
+            with tracing.span("trim_context", blocks=10) as t:
+                t.set("context_chars", 8000)
+            sp.set("intent", "exam_rules_general")
+        with tracing.span("completion", model="gpt-4o-mini") as c:
+            c.set("total_tokens", 2500)
+        root.set("model", "gpt-4o-mini")
+
+
+SPANS_PER_REQUEST = 11
+
+
+def measure(n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        fake_request()
+    tracing.flush()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    n = args.requests
+
+    with tempfile.TemporaryDirectory() as tmp:
+        modes = [
+            ("disabled", None),
+            ("memory", MemoryExporter()),
+            ("jsonl", tracing.JsonlExporter(os.path.join(tmp, "traces.jsonl"))),
+        ]
+
+        baseline = None
+
+        for name, exporter in modes:
+            tracing.set_exporter(exporter)
+            measure(min(n, 1000))
+            tracing.dropped = 0
+            elapsed = measure(n)
+
+            per_request = elapsed / n * 1e6
+            per_span = per_request / SPANS_PER_REQUEST
+            baseline = baseline or per_request
+
+            print(
+                f"{name:>9}: {per_request:8.1f} us/request "
+                f"| {per_span:6.2f} us/span "
+                f"| x{per_request / baseline:.1f} vs disabled "
+                f"| dropped {tracing.dropped} spans"
+            )
+
+    tracing.set_exporter(None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Recall@k of reduced and quantized embeddings against full precision.
+
+Run from backend/ with a float32 snapshot exported at full size:
+
+    python benchmarks/vector_recall.py --snapshot PATH [--k 10]
+
+Each query in --queries (JSONL with "question") is embedded once at full
+size and cached next to the query file. Every dimensions x dtype variant is
+built the way the app would build it: truncate and renormalize, then
+vectors.compact(). Recall is the overlap with the float32 full-size top-k,
+so it measures what reduction and quantization lose, not answer quality.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import snapshot
+import vectors
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FULL_DIMENSIONS = 1536
+
+
+def load_queries(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def embed_queries(queries: list, cache_path: str) -> np.ndarray:
+    if os.path.exists(cache_path):
+        cached = np.load(cache_path)
+        if len(cached) == len(queries):
+            return cached
+
+    from openai import OpenAI
+
+    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    res = client.embeddings.create(
+        model="text-embedding-3-small",
+        input=[q["question"] for q in queries],
+    )
+
+    matrix = np.array([d.embedding for d in res.data], dtype=np.float32)
+    np.save(cache_path, matrix)
+
+    return matrix
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--snapshot", default=snapshot.SNAPSHOT_DIR)
+    parser.add_argument("--queries", default=os.path.join(HERE, "recall_queries.jsonl"))
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dims", default="1536,1024,768,512,256")
+    parser.add_argument("--dtypes", default="float32,float16,int8")
+    args = parser.parse_args()
+
+    if not args.snapshot:
+        raise ValueError("Missing --snapshot or SNAPSHOT_DIR")
+
+    snap = snapshot.open_current(args.snapshot)
+
+    if snap.dtype == "int8":
+        raise ValueError("Baseline snapshot must be float32 or float16, not int8")
+
+    base = np.asarray(snap.vectors, dtype=np.float32)
+
+    if base.shape[1] != FULL_DIMENSIONS:
+        print(f"Merk: snapshot har {base.shape[1]} dimensjoner, ikke {FULL_DIMENSIONS}")
+
+    queries = load_queries(args.queries)
+    full = embed_queries(queries, os.path.splitext(args.queries)[0] + ".npy")
+
+    k = args.k
+    baseline = [vectors.top_k(base, q, k) for q in full]
+
+    print(f"{len(base)} chunks, {len(queries)} queries, k={k}")
+
+    for dims in (int(d) for d in args.dims.split(",")):
+        if dims > base.shape[1]:
+            continue
+
+        reduced = vectors.reduce(base, dims)
+
+        for dtype in args.dtypes.split(","):
+            matrix = vectors.compact(reduced, dtype)
+
+            start = time.perf_counter()
+            results = [vectors.top_k(matrix, q, k) for q in full]
+            per_query = (time.perf_counter() - start) / len(full) * 1000
+
+            recall = np.mean([
+                len(set(r) & set(b)) / len(b) if b else 1.0
+                for r, b in zip(results, baseline)
+            ])
+
+            print(
+                f"{dims:>5} {dtype:>8}: {matrix.nbytes / 1e6:8.2f} MB "
+                f"| recall@{k} {recall:.3f} "
+                f"| {per_query:.2f} ms/query"
+            )
+
+    snap.close()
+
+
+if __name__ == "__main__":
+    main()
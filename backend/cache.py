@@ -0,0 +1,274 @@
+import os
+import threading
+from typing import Any, Callable, Dict, List, Tuple
+
+import psycopg
+from dotenv import load_dotenv
+
+from changes import CHANNEL, fetch_generations, parse_payload
+
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+POLL_INTERVAL = float(os.getenv("CACHE_POLL_INTERVAL", "30"))
+USE_LISTEN = os.getenv("CACHE_LISTEN", "1") != "0"
+
+# Replaced values are closed this long after the swap, so requests that
+# still hold them can finish.
+RETIRE_DELAY = 30.0
+
+
+_lock = threading.RLock()
+
+_loaders: Dict[str, Tuple[Tuple[str, ...], Callable[[], Any]]] = {}
+_values: Dict[str, Any] = {}
+_generations: Dict[str, int] = {}
+_sources: Dict[str, Callable[[], int]] = {}
+_optional: set = set()
+_connection: Callable[[], Any] | None = None
+
+# Per cache, the generation of each of its tables when it was loaded.
+_loaded_at: Dict[str, Dict[str, int]] = {}
+
+_stop = threading.Event()
+_listener: threading.Thread | None = None
+
+
+def register(
+    name: str,
+    tables: Tuple[str, ...],
+    loader: Callable[[], Any],
+    critical: bool = True,
+):
+    """A cache that is not critical may fail to warm up without keeping the
+    worker unready; get() retries it on first use."""
+
+    with _lock:
+        _loaders[name] = (tables, loader)
+        _values.pop(name, None)
+        _loaded_at.pop(name, None)
+
+        if critical:
+            _optional.discard(name)
+        else:
+            _optional.add(name)
+
+
+def register_source(table: str, generation: Callable[[], int]):
+    _sources[table] = generation
+
+
+def use_connection(connect: Callable[[], Any]):
+    """Connection used to read table generations before a cache loads."""
+
+    global _connection
+    _connection = connect
+
+
+def _read_generations(conn=None) -> Dict[str, int]:
+
+    generations = {table: fn() for table, fn in _sources.items()}
+
+    if conn is None and _connection is not None and DATABASE_URL:
+        try:
+            conn = _connection()
+        except Exception:
+            conn = None
+
+    if conn is not None:
+        generations.update(fetch_generations(conn))
+
+    return generations
+
+
+def _retire(value: Any):
+
+    if hasattr(value, "close"):
+        timer = threading.Timer(RETIRE_DELAY, value.close)
+        timer.daemon = True
+        timer.start()
+
+
+def _load(name: str):
+
+    tables, loader = _loaders[name]
+
+    # Read before loading: a change published while the loader runs then
+    # still looks newer than what was loaded.
+    generations = _read_generations()
+
+    value = loader()
+    old = _values.get(name)
+
+    _values[name] = value
+    _loaded_at[name] = {t: generations[t] for t in tables if t in generations}
+
+    if old is not None:
+        _retire(old)
+
+
+def get(name: str) -> Any:
+
+    value = _values.get(name)
+
+    if value is not None:
+        return value
+
+    with _lock:
+
+        if name not in _values:
+            _load(name)
+
+        return _values[name]
+
+
+def caches_for_table(table: str) -> List[str]:
+
+    return [
+        name for name, (tables, _) in _loaders.items()
+        if table in tables
+    ]
+
+
+def reload_table(table: str, generation: int | None = None) -> List[str]:
+    """Reloads the loaded caches for table that are older than generation
+    (all of them when it is None)."""
+
+    reloaded = []
+
+    with _lock:
+
+        if generation is not None:
+            _generations[table] = max(_generations.get(table, 0), generation)
+
+        for name in caches_for_table(table):
+
+            if name not in _values:
+                # Not loaded yet; get() loads the current data.
+                continue
+
+            # A cache loaded without knowing the generation counts as stale.
+            if generation is not None and _loaded_at.get(name, {}).get(table, 0) >= generation:
+                continue
+
+            _load(name)
+            reloaded.append(name)
+
+    if reloaded:
+        print(f"[cache] {table} gen={generation}: lastet {', '.join(reloaded)}")
+
+    return reloaded
+
+
+def warm_up() -> Dict[str, Exception]:
+    """Loads every cache. Raises if a critical one fails; returns the
+    optional ones that failed."""
+
+    failed = {}
+
+    for name in list(_loaders):
+        try:
+            get(name)
+        except Exception as e:
+            if name not in _optional:
+                raise
+            failed[name] = e
+
+    return failed
+
+
+def stats() -> Dict[str, Any]:
+
+    return {
+        "loaded": sorted(_values),
+        "generations": dict(_generations),
+    }
+
+
+def _sync_generations(conn=None):
+
+    for table, generation in _read_generations(conn).items():
+        reload_table(table, generation)
+
+
+def _listen(conn):
+
+    conn.execute(f"LISTEN {CHANNEL}")
+
+    while not _stop.is_set():
+
+        for notify in conn.notifies(timeout=POLL_INTERVAL):
+
+            try:
+                change = parse_payload(notify.payload)
+                reload_table(change["table"], change["generation"])
+            except Exception as e:
+                print(f"[cache] ugyldig varsel {notify.payload!r}: {e}")
+
+            if _stop.is_set():
+                break
+
+        _sync_generations(conn)
+
+
+def _poll(conn):
+
+    while not _stop.wait(POLL_INTERVAL):
+        _sync_generations(conn)
+
+
+def _run_listener():
+
+    if not DATABASE_URL:
+        print("[cache] ingen DATABASE_URL, poller lokale kilder")
+        while not _stop.wait(POLL_INTERVAL):
+            try:
+                _sync_generations()
+            except Exception as e:
+                print(f"[cache] polling feilet: {e}")
+        return
+
+    while not _stop.is_set():
+
+        try:
+            with psycopg.connect(DATABASE_URL, autocommit=True) as conn:
+
+                _sync_generations(conn)
+
+                if not USE_LISTEN:
+                    _poll(conn)
+                    continue
+
+                try:
+                    _listen(conn)
+                except psycopg.errors.FeatureNotSupported as e:
+                    print(f"[cache] LISTEN ikke tilgjengelig ({e}), bruker polling")
+                    _poll(conn)
+
+        except Exception as e:
+            print(f"[cache] lytter feilet: {e}")
+            _stop.wait(POLL_INTERVAL)
+
+
+def start_listener():
+
+    global _listener
+
+    if _listener is not None and _listener.is_alive():
+        return
+
+    _stop.clear()
+
+    _listener = threading.Thread(
+        target=_run_listener,
+        name="cache-listener",
+        daemon=True,
+    )
+    _listener.start()
+
+
+def stop_listener():
+
+    _stop.set()
@@ -0,0 +1,74 @@
+import json
+from typing import Dict
+
+from psycopg import errors
+from psycopg.rows import tuple_row
+
+
+CHANNEL = "studieveileder_changes"
+
+GENERATIONS_TABLE = "cache_generations"
+
+
+def ensure_generations_table(conn):
+
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {GENERATIONS_TABLE} (
+                tabell text PRIMARY KEY,
+                generation bigint NOT NULL,
+                updated_at timestamptz NOT NULL DEFAULT NOW()
+            )
+            """
+        )
+
+
+def publish_change(conn, table: str) -> int:
+
+    ensure_generations_table(conn)
+
+    with conn.cursor(row_factory=tuple_row) as cur:
+
+        cur.execute(
+            f"""
+            INSERT INTO {GENERATIONS_TABLE} (tabell, generation, updated_at)
+            VALUES (%s, 1, NOW())
+            ON CONFLICT (tabell)
+            DO UPDATE SET
+                generation = {GENERATIONS_TABLE}.generation + 1,
+                updated_at = NOW()
+            RETURNING generation
+            """,
+            (table,),
+        )
+
+        generation = cur.fetchone()[0]
+
+        cur.execute(
+            "SELECT pg_notify(%s, %s)",
+            (CHANNEL, json.dumps({"table": table, "generation": generation})),
+        )
+
+    conn.commit()
+
+    print(f"Publiserte endring: {table} (generasjon {generation})")
+
+    return generation
+
+
+def fetch_generations(conn) -> Dict[str, int]:
+
+    try:
+        with conn.cursor(row_factory=tuple_row) as cur:
+            cur.execute(f"SELECT tabell, generation FROM {GENERATIONS_TABLE}")
+            return {table: generation for table, generation in cur.fetchall()}
+    except errors.UndefinedTable:
+        return {}
+
+
+def parse_payload(payload: str) -> Dict[str, int | str]:
+
+    data = json.loads(payload)
+
+    return {"table": str(data["table"]), "generation": int(data["generation"])}
@@ -0,0 +1,171 @@
+"""
+Token-limited chunking of page text.
+
+Paragraphs are packed into chunks of at most CHUNK_MAX_TOKENS. A paragraph
+that is too long on its own is split on sentence boundaries, and a sentence
+that is still too long into token windows. Each new chunk repeats the last
+sentences of the previous one, up to CHUNK_OVERLAP_TOKENS, and a tail
+shorter than CHUNK_MIN_TOKENS is folded into the chunk before it if the
+result still fits in CHUNK_MAX_TOKENS. CHUNK_MIN_TOKENS only governs that
+tail: a chunk ends early when the next paragraph does not fit, since
+merging across it would break the maximum. The budget includes the
+separators units are joined with, so the joined chunk stays within it.
+"""
+import os
+import re
+from typing import Iterator, List, Tuple
+
+import tiktoken
+
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "256"))
+CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", "64"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n+")
+SENTENCE_END = re.compile(r"(?<=[.!?:;])\s+|\n+")
+
+_encoding = None
+
+
+def get_encoding():
+    global _encoding
+
+    # Loaded on first use; tiktoken fetches the BPE file once and caches it.
+    if _encoding is None:
+        _encoding = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    return len(get_encoding().encode_ordinary(text))
+
+
+def iter_paragraphs(text: str) -> Iterator[str]:
+    start = 0
+
+    for m in PARAGRAPH_BREAK.finditer(text):
+        para = text[start:m.start()].strip()
+        if para:
+            yield para
+        start = m.end()
+
+    para = text[start:].strip()
+    if para:
+        yield para
+
+
+def split_tokens(sentence: str, max_tokens: int) -> Iterator[Tuple[str, int]]:
+    encoding = get_encoding()
+    tokens = encoding.encode_ordinary(sentence)
+
+    # Character offset of every token, so windows never cut a character.
+    decoded, offsets = encoding.decode_with_offsets(tokens)
+    offsets.append(len(decoded))
+
+    for start in range(0, len(tokens), max_tokens):
+        end = min(start + max_tokens, len(tokens))
+        part = decoded[offsets[start]:offsets[end]].strip()
+
+        if part:
+            yield part, end - start
+
+
+# A unit is (text, tokens, starts_paragraph).
+def iter_units(text: str, max_tokens: int) -> Iterator[Tuple[str, int, bool]]:
+    for para in iter_paragraphs(text):
+        tokens = count_tokens(para)
+
+        if tokens <= max_tokens:
+            yield para, tokens, True
+            continue
+
+        first = True
+
+        for sentence in SENTENCE_END.split(para):
+            if not sentence:
+                continue
+
+            tokens = count_tokens(sentence)
+            if tokens <= max_tokens:
+                parts = [(sentence, tokens)]
+            else:
+                parts = split_tokens(sentence, max_tokens)
+
+            for part, n in parts:
+                yield part, n, first
+                first = False
+
+
+def join_units(units: List[Tuple[str, int, bool]]) -> str:
+    out = []
+
+    for text, _, starts_paragraph in units:
+        if out:
+            out.append("\n\n" if starts_paragraph else " ")
+        out.append(text)
+
+    return "".join(out)
+
+
+def chunk_text(
+    text: str,
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    min_tokens: int = CHUNK_MIN_TOKENS,
+    overlap: int = CHUNK_OVERLAP_TOKENS,
+) -> Iterator[str]:
+
+    # Tokens of the separator join_units puts before a unit.
+    separator = {True: count_tokens("\n\n"), False: count_tokens(" ")}
+
+    buffer: List[Tuple[str, int, bool]] = []
+    tokens = 0
+
+    # carried: units at the start of buffer repeated from the previous
+    # chunk; fresh: tokens added after them.
+    carried = 0
+    fresh = 0
+
+    # The last full chunk is held back so a short tail can be folded into it.
+    held = None
+
+    for unit in iter_units(text, max_tokens):
+        n = unit[1]
+
+        if fresh and tokens + separator[unit[2]] + n > max_tokens:
+            if held is not None:
+                yield join_units(held)
+            held = buffer
+
+            carried, tokens = 0, 0
+            room = min(overlap, max_tokens - n - separator[unit[2]])
+
+            for i in range(len(buffer) - 1, -1, -1):
+                # Plus the separator before the unit already carried after it.
+                cost = buffer[i][1] + (separator[buffer[i + 1][2]] if carried else 0)
+                if tokens + cost > room:
+                    break
+                carried += 1
+                tokens += cost
+
+            buffer, fresh = buffer[len(buffer) - carried:], 0
+
+        cost = n + (separator[unit[2]] if buffer else 0)
+        buffer.append(unit)
+        tokens += cost
+        fresh += cost
+
+    # Counted on the joined text; this runs once per document.
+    if held is not None and fresh and fresh < min_tokens:
+        folded = held + buffer[carried:]
+        if count_tokens(join_units(folded)) <= max_tokens:
+            held, fresh = folded, 0
+
+    if held is not None:
+        yield join_units(held)
+
+    if fresh:
+        yield join_units(buffer)
@@ -0,0 +1,126 @@
+"""
+MinHash/LSH near-duplicate detection for chunks.
+
+Each chunk is reduced to a MinHash signature over word shingles and the
+signature is split into bands; chunks sharing any band bucket are
+candidates, and a candidate is a duplicate when the estimated Jaccard
+similarity reaches DEDUP_THRESHOLD. With 16 bands of 8 rows, pairs above
+~0.7 similarity almost always share a bucket.
+
+An entry costs about 3.5 KB (signature, band keys, bucket lists), so the
+index keeps at most DEDUP_MAX_CHUNKS canonical chunks and drops the least
+recently matched one beyond that. Repeated boilerplate keeps matching and
+stays; a chunk seen again only after it was dropped is kept once more.
+"""
+import os
+import re
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.8"))
+DEDUP_MAX_CHUNKS = int(os.getenv("DEDUP_MAX_CHUNKS", "20000"))
+NUM_PERM = 128
+BANDS = 16
+SHINGLE_SIZE = 3
+
+# Mersenne prime; keeps a * x + b inside uint64 for 31-bit inputs.
+_PRIME = (1 << 31) - 1
+
+_rng = np.random.default_rng(1)
+_A = _rng.integers(1, _PRIME, NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, NUM_PERM, dtype=np.uint64)
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    words = re.findall(r"\w+", text.lower())
+
+    if len(words) < size:
+        grams = {" ".join(words)}
+    else:
+        grams = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+    return np.fromiter(
+        (zlib.crc32(g.encode("utf-8")) % _PRIME for g in grams),
+        dtype=np.uint64,
+        count=len(grams),
+    )
+
+
+def signature(text: str) -> np.ndarray:
+    x = shingles(text)
+    return ((_A[:, None] * x[None, :] + _B[:, None]) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.count_nonzero(a == b)) / len(a)
+
+
+class NearDuplicateIndex:
+
+    def __init__(
+        self,
+        threshold: float = DEDUP_THRESHOLD,
+        bands: int = BANDS,
+        max_entries: int = DEDUP_MAX_CHUNKS,
+    ):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = NUM_PERM // bands
+        self.max_entries = max_entries
+        self.buckets: List[Dict[bytes, List[str]]] = [{} for _ in range(bands)]
+        # Least recently matched first.
+        self.signatures: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.evicted = 0
+
+    def _bands(self, sig: np.ndarray) -> List[bytes]:
+        return [
+            sig[i * self.rows:(i + 1) * self.rows].tobytes()
+            for i in range(self.bands)
+        ]
+
+    def add(self, key: str, text: str) -> Optional[str]:
+        """Key of the canonical chunk text duplicates; otherwise text becomes
+        canonical under key and None is returned."""
+        sig = signature(text)
+        bands = self._bands(sig)
+
+        checked = set()
+
+        for bucket, band in zip(self.buckets, bands):
+            for candidate in bucket.get(band, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+
+                if similarity(sig, self.signatures[candidate]) >= self.threshold:
+                    self.signatures.move_to_end(candidate)
+                    return candidate
+
+        self.signatures[key] = sig
+
+        for bucket, band in zip(self.buckets, bands):
+            bucket.setdefault(band, []).append(key)
+
+        while len(self.signatures) > self.max_entries:
+            self._evict()
+
+        return None
+
+    def _evict(self):
+        key, sig = self.signatures.popitem(last=False)
+
+        for bucket, band in zip(self.buckets, self._bands(sig)):
+            keys = bucket[band]
+            keys.remove(key)
+
+            if not keys:
+                del bucket[band]
+
+        self.evicted += 1
+
+    def __len__(self) -> int:
+        return len(self.signatures)
@@ -1,58 +1,63 @@
 import os
+import sys
 import json
 import re
-from typing import List
+import uuid
+import hashlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Set
 
 import psycopg
+from pgvector import HalfVector
+from pgvector.psycopg import register_vector
 from openai import OpenAI
 from dotenv import load_dotenv
 
+import llm_replay
+import vectors
+from changes import publish_change
+from chunking import chunk_text, get_encoding
+from dedup import NearDuplicateIndex
+from journal import RunJournal, hash_inputs
+from ratelimit import RateLimiter, call_with_backoff
+
 
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Retries are ours (call_with_backoff), so the SDK must not add its own.
+client = llm_replay.connect(
+    lambda: OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0),
+    "embedding_db",
+)
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 EMBEDDING_MODEL = "text-embedding-3-small"
 LLM_MODEL = "gpt-4.1-mini"
 
-CHUNK_SIZE = 300
-
-
-def split_paragraphs(text: str) -> List[str]:
-
-    return [
-        p.strip()
-        for p in re.split(r"\n\s*\n+", text)
-        if p.strip()
-    ]
-
-
-def chunk_text(text: str, max_size: int = CHUNK_SIZE) -> List[str]:
-
-    paragraphs = split_paragraphs(text)
-
-    chunks = []
-    buffer = ""
-
-    for para in paragraphs:
+CONTEXT_WORKERS = int(os.getenv("CONTEXT_WORKERS", "16"))
+CONTEXT_RPM = float(os.getenv("CONTEXT_RPM", "500"))
+CONTEXT_TPM = float(os.getenv("CONTEXT_TPM", "200000"))
+CONTEXT_MAX_TOKENS = 80
 
-        if len(buffer) + len(para) <= max_size:
+# Documents whose chunks may be in flight at once; results are still
+# stored in input order.
+DOC_WINDOW = 32
 
-            buffer += ("\n\n" if buffer else "") + para
+# Per-request limits of the embeddings endpoint. The API allows 300k tokens
+# per request; EMBED_BATCH_TOKENS stays a little below it.
+EMBED_MAX_INPUTS = 2048
+EMBED_MAX_INPUT_TOKENS = 8191
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "250000"))
 
-        else:
-
-            if buffer:
-                chunks.append(buffer.strip())
-
-            buffer = para
+# Rows buffered before one COPY + merge round trip.
+COPY_BATCH = 500
 
-    if buffer:
-        chunks.append(buffer.strip())
+EMBEDDING_COLUMNS = ("url", "title", "text", "embedding", "content_hash", "last_seen_run")
+EMBEDDING_TYPES = ["text", "text", "text", vectors.EMBEDDING_STORAGE, "text", "text"]
 
-    return chunks
+context_limiter = RateLimiter(CONTEXT_RPM, CONTEXT_TPM)
 
 
 def is_good_chunk(text: str) -> bool:
@@ -94,20 +99,29 @@ Chunk:
 Write only the sentence.
 """
 
-    response = client.chat.completions.create(
-        model=LLM_MODEL,
-        messages=[
-            {
-                "role": "system",
-                "content": "You generate short factual retrieval summaries."
-            },
-            {
-                "role": "user",
-                "content": prompt
-            }
-        ],
-        temperature=0
-    )
+    messages = [
+        {
+            "role": "system",
+            "content": "You generate short factual retrieval summaries."
+        },
+        {
+            "role": "user",
+            "content": prompt
+        }
+    ]
+
+    def call():
+        # Rough estimate (4 chars/token) of prompt plus the capped answer.
+        context_limiter.acquire(len(prompt) // 4 + CONTEXT_MAX_TOKENS)
+
+        return client.chat.completions.create(
+            model=LLM_MODEL,
+            messages=messages,
+            temperature=0,
+            max_tokens=CONTEXT_MAX_TOKENS,
+        )
+
+    response = call_with_backoff(call)
 
     context = response.choices[0].message.content.strip()
 
@@ -131,33 +145,247 @@ Write only the sentence.
     return f"{context}\n\n{chunk}"
 
 
-def get_embeddings(
-    texts: List[str],
-    max_chars: int = 6000
-) -> List[List[float]]:
+def contextualize_chunks(
+    pool: ThreadPoolExecutor,
+    full_doc: str,
+    chunks: List[str]
+) -> List[Future]:
 
-    safe_texts = []
+    return [
+        pool.submit(add_context_to_chunk, full_doc, chunk)
+        for chunk in chunks
+    ]
 
-    for t in texts:
 
-        if len(t) > max_chars:
-            safe_texts.append(t[:max_chars])
-        else:
-            safe_texts.append(t)
+def chunk_hash(url: str, chunk: str) -> str:
+
+    key = "\0".join([url, chunk, LLM_MODEL, EMBEDDING_MODEL])
+
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def ensure_schema(conn):
+
+    with conn.cursor() as cur:
+        cur.execute(
+            "ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS content_hash text"
+        )
+        cur.execute(
+            "ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS last_seen_run text"
+        )
+        cur.execute(
+            "ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS urls text[]"
+        )
+        cur.execute(
+            "ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS urls_run text"
+        )
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_content_hash_idx "
+            "ON embeddings (content_hash)"
+        )
+
+    conn.commit()
+
+
+def ensure_storage(conn):
+
+    target = f"{vectors.EMBEDDING_STORAGE}({vectors.EMBEDDING_DIMENSIONS})"
+
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT format_type(atttypid, atttypmod)
+            FROM pg_attribute
+            WHERE attrelid = 'embeddings'::regclass AND attname = 'embedding'
+            """
+        )
+        current = cur.fetchone()[0]
+
+        if current == target:
+            return
+
+        cur.execute("SELECT max(vector_dims(embedding::vector)) FROM embeddings")
+        dims = cur.fetchone()[0]
+
+        if dims and dims < vectors.EMBEDDING_DIMENSIONS:
+            raise ValueError(
+                f"embeddings has {dims} dimensions; re-embed to grow to "
+                f"{vectors.EMBEDDING_DIMENSIONS}"
+            )
+
+        # Vector indexes are tied to one column type and size.
+        cur.execute(
+            """
+            SELECT i.indexrelid::regclass::text
+            FROM pg_index i
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+            WHERE i.indrelid = 'embeddings'::regclass AND a.attname = 'embedding'
+            """
+        )
+        for (index,) in cur.fetchall():
+            print(
+                f"Dropper indeks {index}; bygg det på nytt med "
+                f"python vector_index.py build|sweep"
+            )
+            cur.execute(f"DROP INDEX {index}")
+
+        # Shortened text-embedding-3 vectors are the full vectors truncated
+        # and renormalized, so existing rows need no new API calls.
+        cur.execute(
+            f"""
+            ALTER TABLE embeddings
+            ALTER COLUMN embedding TYPE {target}
+            USING l2_normalize(
+                subvector(embedding::vector, 1, {vectors.EMBEDDING_DIMENSIONS})
+            )::{target}
+            """
+        )
+
+    conn.commit()
+
+    print(f"embeddings.embedding: {current} -> {target}")
+
+
+def mark_seen(conn, hashes: List[str], run_id: str) -> Set[str]:
+
+    if not hashes:
+        return set()
+
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE embeddings
+            SET last_seen_run = %s
+            WHERE content_hash = ANY(%s)
+            RETURNING content_hash
+            """,
+            (run_id, hashes)
+        )
+        found = {r[0] for r in cur.fetchall()}
 
-    res = client.embeddings.create(
-        model=EMBEDDING_MODEL,
-        input=safe_texts
+    conn.commit()
+
+    return found
+
+
+def merge_sources(conn, sources: Dict[str, List[str]], run_id: str):
+
+    # Every page a canonical chunk (or one of its near-duplicates) was seen
+    # on, merged a batch at a time. The first merge in a run replaces the
+    # list, so pages that dropped the chunk since the last run fall away.
+    if not sources:
+        return
+
+    with conn.cursor() as cur:
+        cur.executemany(
+            """
+            UPDATE embeddings
+            SET urls = CASE
+                    WHEN urls_run = %(run)s THEN ARRAY(
+                        SELECT u
+                        FROM unnest(urls || %(urls)s::text[]) WITH ORDINALITY AS t(u, i)
+                        GROUP BY u
+                        ORDER BY min(i)
+                    )
+                    ELSE %(urls)s::text[]
+                END,
+                urls_run = %(run)s
+            WHERE content_hash = %(hash)s
+            """,
+            [{"run": run_id, "urls": urls, "hash": h} for h, urls in sources.items()]
+        )
+
+
+def remove_stale(conn, run_id: str) -> int:
+
+    # Rows without a hash predate incremental indexing and have been
+    # re-embedded under a hash by this run.
+    with conn.cursor() as cur:
+        cur.execute(
+            "DELETE FROM embeddings WHERE last_seen_run IS DISTINCT FROM %s",
+            (run_id,)
+        )
+        removed = cur.rowcount
+
+    conn.commit()
+
+    return removed
+
+
+def truncate_tokens(text: str, max_tokens: int = EMBED_MAX_INPUT_TOKENS):
+
+    encoding = get_encoding()
+    tokens = encoding.encode(text, disallowed_special=())
+
+    if len(tokens) > max_tokens:
+        tokens = tokens[:max_tokens]
+        text = encoding.decode(tokens)
+
+    return text, len(tokens)
+
+
+def get_embeddings(texts: List[str]) -> List[List[float]]:
+
+    res = call_with_backoff(
+        lambda: client.embeddings.create(
+            model=EMBEDDING_MODEL,
+            input=texts,
+            dimensions=vectors.EMBEDDING_DIMENSIONS
+        )
     )
 
-    return [d.embedding for d in res.data]
+    return [d.embedding for d in sorted(res.data, key=lambda d: d.index)]
+
+
+class EmbeddingBatcher:
+    """Packs chunks from many documents into as few embedding requests as
+    the input-count and token limits allow."""
+
+    def __init__(self, max_inputs: int = EMBED_MAX_INPUTS, max_tokens: int = EMBED_BATCH_TOKENS):
+        self.max_inputs = max_inputs
+        self.max_tokens = max_tokens
+        self.texts: List[str] = []
+        self.items: List[tuple] = []
+        self.tokens = 0
+        self.requests = 0
 
+    def add(self, text: str, item: tuple) -> List[tuple]:
+        text, tokens = truncate_tokens(text)
 
-def store_embeddings(conn, rows):
+        done = []
 
-    sql = """
-        INSERT INTO embeddings (url, title, text, embedding)
-        VALUES (%s, %s, %s, %s)
+        if self.texts and (
+            len(self.texts) >= self.max_inputs
+            or self.tokens + tokens > self.max_tokens
+        ):
+            done = self.flush()
+
+        self.texts.append(text)
+        self.items.append(item)
+        self.tokens += tokens
+
+        return done
+
+    def flush(self) -> List[tuple]:
+        """Embed everything queued; returns (item, embedding) pairs in order."""
+        if not self.texts:
+            return []
+
+        embeddings = get_embeddings(self.texts)
+        self.requests += 1
+
+        done = list(zip(self.items, embeddings))
+
+        self.texts, self.items, self.tokens = [], [], 0
+
+        return done
+
+
+def store_embeddings(conn, rows, table: str = "embeddings"):
+
+    sql = f"""
+        INSERT INTO {table} ({", ".join(EMBEDDING_COLUMNS)})
+        VALUES (%s, %s, %s, %s, %s, %s)
     """
 
     with conn.cursor() as cur:
@@ -166,64 +394,437 @@ def store_embeddings(conn, rows):
     conn.commit()
 
 
-def load_json(path):
+def copy_embeddings(conn, rows, table: str = "embeddings", commit: bool = True) -> int:
+
+    if not rows:
+        return 0
+
+    columns = ", ".join(EMBEDDING_COLUMNS)
+    staging = f"{table}_staging"
+
+    # Binary COPY needs the staging column to have the storage type, and
+    # the halfvec dumper only takes HalfVector values.
+    halfvec = vectors.EMBEDDING_STORAGE == "halfvec"
+
+    with conn.cursor() as cur:
+
+        cur.execute(
+            f"""
+            CREATE TEMP TABLE IF NOT EXISTS {staging} (
+                url text,
+                title text,
+                text text,
+                embedding {vectors.EMBEDDING_STORAGE},
+                content_hash text,
+                last_seen_run text
+            ) ON COMMIT DELETE ROWS
+            """
+        )
+
+        with cur.copy(f"COPY {staging} ({columns}) FROM STDIN WITH (FORMAT BINARY)") as copy:
+            copy.set_types(EMBEDDING_TYPES)
+            for row in rows:
+                if halfvec:
+                    row = (*row[:3], HalfVector(row[3]), *row[4:])
+                copy.write_row(row)
+
+        cur.execute(
+            f"""
+            INSERT INTO {table} ({columns})
+            SELECT {columns}
+            FROM {staging} s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {table} e
+                WHERE e.content_hash = s.content_hash
+            )
+            """
+        )
+        inserted = cur.rowcount
+
+    if commit:
+        conn.commit()
+
+    return inserted
+
+
+def iter_json_array(path: str, read_size: int = 1 << 16) -> Iterator[dict]:
+
+    decoder = json.JSONDecoder()
 
     with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
 
+        buf = ""
+        pos = 0
+        eof = False
 
-def process_json(json_file: str):
+        def fill():
+            nonlocal buf, pos, eof
+            more = f.read(read_size)
+            eof = not more
+            buf = buf[pos:] + more
+            pos = 0
 
-    data = load_json(json_file)
+        def skip(chars: str):
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in chars:
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                fill()
 
-    total = 0
+        skip(" \t\r\n")
 
-    with psycopg.connect(DATABASE_URL) as conn:
+        if pos >= len(buf) or buf[pos] != "[":
+            raise ValueError(f"{path}: expected a JSON array")
 
-        for item in data:
+        pos += 1
+
+        while True:
+
+            skip(" \t\r\n,")
+
+            if pos >= len(buf):
+                raise ValueError(f"{path}: unterminated JSON array")
+
+            if buf[pos] == "]":
+                return
+
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+
+            # A value that ends exactly at the buffer edge may be cut short.
+            if end == len(buf) and not eof:
+                fill()
+                continue
+
+            pos = end
+
+            yield item
+
+
+def iter_jsonl(path: str) -> Iterator[dict]:
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_documents(path: str) -> Iterator[dict]:
+
+    if path.endswith((".jsonl", ".ndjson")):
+        return iter_jsonl(path)
+
+    return iter_json_array(path)
+
+
+def source_id(path: str) -> dict:
+
+    st = os.stat(path)
+
+    return {
+        "source": os.path.abspath(path),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+    }
+
+
+def load_checkpoint(path: str) -> Optional[dict]:
+
+    try:
+        with open(f"{path}.checkpoint", "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    # A changed input file invalidates document positions.
+    if {k: checkpoint.get(k) for k in ("source", "size", "mtime_ns")} != source_id(path):
+        return None
+
+    return checkpoint
+
+
+def save_checkpoint(path: str, checkpoint: dict):
+
+    tmp = f"{path}.checkpoint.tmp"
+
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+
+    os.replace(tmp, f"{path}.checkpoint")
+
+
+def clear_checkpoint(path: str):
+
+    try:
+        os.remove(f"{path}.checkpoint")
+    except FileNotFoundError:
+        pass
+
+
+def process_json(json_file: str, only_failed: bool = False):
+
+    checkpoint = load_checkpoint(json_file)
+
+    if checkpoint and only_failed:
+        # Chunks are marked with the interrupted run's id, so resuming it
+        # later does not count them as stale.
+        print(f"Retrying failed documents within run {checkpoint['run_id']}")
+    elif checkpoint:
+        print(f"Resuming run {checkpoint['run_id']} at document {checkpoint['done']}")
+    else:
+        checkpoint = {
+            **source_id(json_file),
+            "run_id": uuid.uuid4().hex,
+            "done": 0,
+        }
+
+    run_id = checkpoint["run_id"]
+
+    stats: Dict[str, int] = {
+        "added": 0,
+        "skipped": 0,
+        "duplicates": 0,
+        "removed": 0,
+        "requests": 0,
+        "failed": 0,
+        "failed_earlier": 0,
+    }
+
+    # Per-document outcomes. The checkpoint is what resumes a run; the
+    # journal records which documents failed, so the next run (which skips
+    # every chunk already stored) only spends LLM calls on those, and a
+    # resumed run still knows about failures before the checkpoint.
+    journal = RunJournal("embedding_db")
+
+    # A --failed pass reads the whole input but leaves the checkpoint alone.
+    start = 0 if only_failed else checkpoint["done"]
+
+    # Documents handed to the batcher whose rows are not stored yet:
+    # (index, journal key, document hash, new chunks).
+    unwritten = deque()
+
+    # Boilerplate repeated across pages is kept once, as the first chunk
+    # seen, with the URLs of all its copies. After a resume only chunks
+    # from the resumed part are compared. sources holds the URLs seen since
+    # the last write; those of chunks not stored yet wait in it.
+    duplicates = NearDuplicateIndex()
+    sources: Dict[str, List[str]] = {}
+
+    # Hashes of chunks submitted but not yet stored, so a chunk repeated
+    # inside the window is not embedded twice. Bounded by DOC_WINDOW plus
+    # one embedding request and one COPY batch.
+    pending: Set[str] = set()
+
+    # Chunks are queued across documents until an embedding request is full.
+    batcher = EmbeddingBatcher()
+
+    # Embedded rows waiting for the next COPY, and the document after the
+    # last one handed to the batcher.
+    buffered: List[tuple] = []
+    buffered_through = start
+    flushed = 0
+
+    def embedded(pairs):
+
+        buffered.extend(
+            (url, title, txt, emb, h, run_id)
+            for (_, url, title, txt, h), emb in pairs
+        )
+
+    def write_buffer(conn):
+
+        nonlocal buffered
+
+        if buffered:
+
+            stats["added"] += copy_embeddings(conn, buffered, commit=False)
+
+            pending.difference_update(r[4] for r in buffered)
+
+            print(f"Stored {len(buffered)} | Total: {stats['added']}")
+
+            buffered = []
+
+        # In the same transaction as the rows they belong to.
+        ready = {h: sources.pop(h) for h in list(sources) if h not in pending}
+        merge_sources(conn, ready, run_id)
+        conn.commit()
+
+        # Documents with chunks still queued for embedding are redone on resume.
+        done = batcher.items[0][0] if batcher.items else buffered_through
+
+        if not only_failed:
+            checkpoint["done"] = done
+            save_checkpoint(json_file, checkpoint)
+
+        while unwritten and unwritten[0][0] < done:
+            _, key, doc_hash, n = unwritten.popleft()
+            journal.done(key, doc_hash, chunks=n)
+
+    def flush(conn, index, url, title, doc_hash, hashes, futures):
+
+        nonlocal buffered_through, flushed
+
+        key = url or f"#{index}"
+
+        try:
+            texts = [f.result() for f in futures]
+        except Exception as e:
+            # Only this document's new chunks are dropped; the run goes on.
+            stats["failed"] += 1
+            pending.difference_update(hashes)
+            journal.failed(key, doc_hash, e)
+            print(f"[ERROR] {url}: {e}")
+        else:
+            for txt, h in zip(texts, hashes):
+                embedded(batcher.add(txt, (index, url, title, txt, h)))
+
+            # No hash: too short, already journaled as skipped.
+            if doc_hash is not None:
+                unwritten.append((index, key, doc_hash, len(hashes)))
+
+        buffered_through = index + 1
+        flushed += 1
+
+        # Source URLs go out at least once per window, so they never pile up.
+        if len(buffered) >= COPY_BATCH or flushed % DOC_WINDOW == 0:
+            write_buffer(conn)
+
+    with (
+        psycopg.connect(DATABASE_URL) as conn,
+        ThreadPoolExecutor(max_workers=CONTEXT_WORKERS) as pool,
+    ):
+
+        register_vector(conn)
+        ensure_schema(conn)
+        ensure_storage(conn)
+
+        in_flight = deque()
+
+        for index, item in enumerate(iter_documents(json_file)):
 
             url = item.get("url", "")
             title = item.get("title", "")
             text = item.get("text", "")
 
-            if not text.strip():
-                continue
+            key = url or f"#{index}"
+            doc_hash = hash_inputs(title, text)
 
-            if len(text.strip()) < 150:
+            if index < start:
+                if journal.state(key, doc_hash) == "failed":
+                    stats["failed_earlier"] += 1
                 continue
 
-            full_doc = f"Title: {title}\nURL: {url}\n\n{text}"
+            # In a --failed pass every other document is still chunked, so
+            # duplicates and source URLs come out as in a full pass.
+            run = not only_failed or journal.should_run(key, doc_hash, only_failed=True)
+
+            if not text.strip() or len(text.strip()) < 150:
+                if run:
+                    journal.skipped(key, doc_hash, "for kort")
+                in_flight.append((index, url, title, None, [], []))
+            else:
+                full_doc = f"Title: {title}\nURL: {url}\n\n{text}"
 
-            chunks = chunk_text(text)
+                candidates = {}
 
-            contextualized = []
+                for chunk in chunk_text(text):
 
-            for chunk in chunks:
+                    if not is_good_chunk(chunk):
+                        continue
 
-                if not is_good_chunk(chunk):
+                    h = chunk_hash(url, chunk)
+                    canonical = duplicates.add(h, chunk)
+
+                    if canonical is None:
+                        candidates[h] = chunk
+                        sources.setdefault(h, []).append(url)
+                    else:
+                        stats["duplicates"] += 1
+                        urls = sources.setdefault(canonical, [])
+                        if url not in urls:
+                            urls.append(url)
+
+                if not run:
+                    in_flight.append((index, url, title, None, [], []))
+
+                    if len(in_flight) >= DOC_WINDOW:
+                        flush(conn, *in_flight.popleft())
                     continue
 
-                ctx = add_context_to_chunk(full_doc, chunk)
+                known = mark_seen(conn, list(candidates), run_id) | pending
 
-                contextualized.append(ctx)
+                hashes = [h for h in candidates if h not in known]
+                stats["skipped"] += len(candidates) - len(hashes)
 
-            if not contextualized:
-                continue
+                pending.update(hashes)
+
+                futures = contextualize_chunks(
+                    pool,
+                    full_doc,
+                    [candidates[h] for h in hashes],
+                )
 
-            embeddings = get_embeddings(contextualized)
+                in_flight.append((index, url, title, doc_hash, hashes, futures))
 
-            rows = [
-                (url, title, txt, emb)
-                for txt, emb in zip(contextualized, embeddings)
-            ]
+            if len(in_flight) >= DOC_WINDOW:
+                flush(conn, *in_flight.popleft())
 
-            store_embeddings(conn, rows)
+        while in_flight:
+            flush(conn, *in_flight.popleft())
 
-            total += len(rows)
+        embedded(batcher.flush())
+        write_buffer(conn)
 
-            print(f"Stored {len(rows)} | Total: {total}")
+        # Only after a complete pass do we know which chunks disappeared.
+        # An empty pass is far more likely a broken input than an empty site,
+        # and a failed document, in this run or before the checkpoint, may
+        # have lost rows it still needs. A --failed pass only touches some
+        # documents, so it never removes anything.
+        failed = stats["failed"] + stats["failed_earlier"]
+
+        if not only_failed and checkpoint["done"] and not failed:
+            stats["removed"] = remove_stale(conn, run_id)
+        elif failed:
+            print(f"Beholder gamle rader: {failed} dokumenter feilet, kjør med --failed")
+
+        stats["requests"] = batcher.requests
+
+        if stats["added"] or stats["removed"]:
+            publish_change(conn, "embeddings")
+
+    if not only_failed:
+        clear_checkpoint(json_file)
+
+    print(journal.summary())
+    journal.close()
+    llm_replay.close(client)
+
+    print(
+        f"Done. added={stats['added']} "
+        f"skipped={stats['skipped']} "
+        f"duplicates={stats['duplicates']} "
+        f"removed={stats['removed']} "
+        f"embedding_requests={stats['requests']} "
+        f"failed={stats['failed']} "
+        f"failed_earlier={stats['failed_earlier']}"
+    )
+
+    return stats
 
 
 if __name__ == "__main__":
 
-    process_json("parsing-python/nmbu/nmbu_data.json")
+    args = [a for a in sys.argv[1:] if a != "--failed"]
+
+    process_json(
+        args[0] if args else "parsing-python/nmbu/nmbu_data.json",
+        only_failed="--failed" in sys.argv,
+    )
@@ -0,0 +1,231 @@
+"""
+Append-only run journal for the ingestion scripts.
+
+Every work item (a course file, a document, a study plan PDF) gets one
+JSON line per state change: started, done, skipped or failed, with the
+hash of its inputs and the outcome. The latest line per item is its state,
+so after a crash a script can skip what finished, redo what was left
+"started" and retry only what failed. A changed inputs hash makes an item
+pending again.
+
+    python journal.py status NAME    # states and recent failures
+    python journal.py reset NAME     # forget everything for NAME
+
+Journals live in JOURNAL_DIR (default .cache/journal, relative to backend/).
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Dict, Optional
+
+
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", ".cache/journal")
+
+FINISHED = ("done", "skipped")
+
+# Rewritten to the latest line per item when it grows past this many times
+# the number of items.
+COMPACT_FACTOR = 4
+
+
+def hash_inputs(*parts) -> str:
+    h = hashlib.sha256()
+
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        h.update(part)
+        h.update(b"\0")
+
+    return h.hexdigest()
+
+
+def hash_file(path: str, *extra) -> str:
+    with open(path, "rb") as f:
+        return hash_inputs(f.read(), *extra)
+
+
+class RunJournal:
+
+    def __init__(self, name: str, directory: str = JOURNAL_DIR):
+        self.name = name
+        self.path = os.path.join(directory, f"{name}.jsonl")
+        self.run_id = uuid.uuid4().hex
+        self.lock = threading.Lock()
+
+        self.latest: Dict[str, dict] = {}
+        self.counts = Counter()
+        self.reused = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+        lines = self._load()
+
+        if lines > COMPACT_FACTOR * max(len(self.latest), 256):
+            self._compact()
+
+        self._file = open(self.path, "a", encoding="utf-8")
+
+        # Start on a fresh line after a record cut off by a crash.
+        if self._file.tell() and not self._ends_with_newline():
+            self._file.write("\n")
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _load(self) -> int:
+        lines = 0
+
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A line cut off by the crash we are resuming from.
+                        continue
+
+                    self.latest[record["item"]] = record
+                    lines += 1
+        except FileNotFoundError:
+            pass
+
+        return lines
+
+    def _compact(self):
+        tmp = f"{self.path}.tmp"
+
+        with open(tmp, "w", encoding="utf-8") as f:
+            for record in self.latest.values():
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        os.replace(tmp, self.path)
+
+    def state(self, item: str, inputs_hash: Optional[str] = None) -> Optional[str]:
+        """Latest state of item, or None if unknown or its inputs changed."""
+        record = self.latest.get(item)
+
+        if record is None:
+            return None
+
+        if inputs_hash is not None and record.get("hash") != inputs_hash:
+            return None
+
+        return record["state"]
+
+    def should_run(self, item: str, inputs_hash: Optional[str] = None, only_failed: bool = False) -> bool:
+        state = self.state(item, inputs_hash)
+
+        if only_failed:
+            run = state in ("failed", "started")
+        else:
+            run = state not in FINISHED
+
+        if not run and state in FINISHED:
+            self.reused += 1
+
+        return run
+
+    def record(self, item: str, state: str, inputs_hash: Optional[str] = None, **detail):
+        entry = {
+            "item": item,
+            "state": state,
+            "hash": inputs_hash,
+            "run": self.run_id,
+            "at": round(time.time(), 3),
+        }
+        entry.update(detail)
+
+        line = json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+
+        with self.lock:
+            self._file.write(line)
+            self._file.flush()
+
+            self.latest[item] = entry
+
+            if state != "started":
+                self.counts[state] += 1
+
+    def started(self, item: str, inputs_hash: Optional[str] = None):
+        self.record(item, "started", inputs_hash)
+
+    def done(self, item: str, inputs_hash: Optional[str] = None, **detail):
+        self.record(item, "done", inputs_hash, **detail)
+
+    def skipped(self, item: str, inputs_hash: Optional[str] = None, reason: str = ""):
+        self.record(item, "skipped", inputs_hash, reason=reason)
+
+    def failed(self, item: str, inputs_hash: Optional[str] = None, error=None):
+        self.record(item, "failed", inputs_hash, error=str(error)[:500])
+
+    def failures(self) -> Dict[str, str]:
+        return {
+            item: record.get("error", "")
+            for item, record in self.latest.items()
+            if record["state"] == "failed"
+        }
+
+    def summary(self) -> str:
+        failures = self.failures()
+
+        lines = [
+            f"Journal {self.name}: "
+            f"done={self.counts['done']} skipped={self.counts['skipped']} "
+            f"failed={self.counts['failed']} | "
+            f"ferdig fra før: {self.reused} | "
+            f"feilet totalt: {len(failures)}"
+        ]
+
+        for item, error in list(failures.items())[:10]:
+            lines.append(f"  [failed] {item}: {error}")
+
+        if len(failures) > 10:
+            lines.append(f"  ... og {len(failures) - 10} til")
+
+        return "\n".join(lines)
+
+    def close(self):
+        with self.lock:
+            self._file.close()
+
+
+def main():
+    if len(sys.argv) != 3 or sys.argv[1] not in ("status", "reset"):
+        print("Bruk: python journal.py status|reset NAME")
+        sys.exit(2)
+
+    command, name = sys.argv[1], sys.argv[2]
+
+    if command == "reset":
+        try:
+            os.remove(os.path.join(JOURNAL_DIR, f"{name}.jsonl"))
+        except FileNotFoundError:
+            pass
+
+        print(f"Nullstilte journal {name}")
+        return
+
+    journal = RunJournal(name)
+    states = Counter(r["state"] for r in journal.latest.values())
+
+    print(f"{journal.path}: {len(journal.latest)} elementer")
+
+    for state, n in sorted(states.items()):
+        print(f"  {state}: {n}")
+
+    for item, error in list(journal.failures().items())[:20]:
+        print(f"  [failed] {item}: {error}")
+
+    journal.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Persistent cache for LLM responses in the ingestion scripts.
+
+A response is stored under the SHA-256 of the model, the system prompt and
+the exact user payload, so an unchanged course hits the cache on every
+later run while any change to the text, the prompt or the model misses it.
+Each entry keeps the token usage of the call that produced it, which is
+what a hit saves.
+
+LLM_CACHE is the SQLite file (default .cache/llm.sqlite, relative to
+backend/); set it to an empty string to turn the cache off.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+LLM_CACHE = os.getenv("LLM_CACHE", ".cache/llm.sqlite")
+
+# USD per 1M tokens, (input, output).
+PRICES = {
+    "gpt-4.1-mini": (0.40, 1.60),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    output TEXT NOT NULL,
+    input_tokens INTEGER NOT NULL,
+    output_tokens INTEGER NOT NULL,
+    created_at REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def cache_key(model: str, system: str, payload) -> str:
+    blob = json.dumps(
+        [model, system, payload],
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    price_in, price_out = PRICES.get(model, (0.0, 0.0))
+    return (input_tokens * price_in + output_tokens * price_out) / 1e6
+
+
+class ResponseCache:
+    """Thread-safe; the file is opened on first use, so importing is free."""
+
+    def __init__(self, path: Optional[str] = LLM_CACHE):
+        self.path = path
+        self.lock = threading.Lock()
+        self._db = None
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+        self.saved_usd = 0.0
+        self.spent_usd = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode = WAL")
+            self._db.execute("PRAGMA synchronous = NORMAL")
+            self._db.executescript(SCHEMA)
+
+        return self._db
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.path:
+            return None
+
+        with self.lock:
+            row = self._connect().execute(
+                "SELECT model, output, input_tokens, output_tokens FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            model, output, input_tokens, output_tokens = row
+
+            self.hits += 1
+            self.saved_tokens += input_tokens + output_tokens
+            self.saved_usd += cost(model, input_tokens, output_tokens)
+
+            return output
+
+    def put(self, key: str, model: str, output: str, usage=None):
+        input_tokens = getattr(usage, "input_tokens", 0) or 0
+        output_tokens = getattr(usage, "output_tokens", 0) or 0
+
+        with self.lock:
+            self.spent_usd += cost(model, input_tokens, output_tokens)
+
+            if not self.path:
+                return
+
+            self._connect().execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, output, input_tokens, output_tokens, time.time()),
+            )
+
+    def summary(self) -> str:
+        if not self.path:
+            return f"LLM-cache: av | brukt ${self.spent_usd:.3f}"
+
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups * 100 if lookups else 0.0
+
+        return (
+            f"LLM-cache: {self.hits}/{lookups} treff ({rate:.1f}%) | "
+            f"spart ${self.saved_usd:.3f} ({self.saved_tokens} tokens) | "
+            f"brukt ${self.spent_usd:.3f}"
+        )
+
+    def close(self):
+        with self.lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,247 @@
+"""
+Record/replay of OpenAI calls for the ingestion scripts.
+
+wrap() puts a thin layer around the client's responses.create,
+chat.completions.create and embeddings.create; connect() also builds the
+client, but only when calls can reach the API, so replay needs neither an
+API key nor a network. LLM_REPLAY selects the mode:
+
+    off     calls go straight to the API (default)
+    record  calls go to the API and every request/response pair is
+            appended to the cassette
+    replay  responses come from the cassette; no network is used, and a
+            request that was never recorded raises CassetteMiss
+
+A request is identified by the SHA-256 of its arguments (timeouts
+excluded), so a replayed run must make the same requests as the recorded
+one. Cassettes are gzipped JSON lines in LLM_CASSETTE_DIR (default
+.cache/cassettes, relative to backend/), one per script; embedding vectors
+are stored as base64 float32.
+
+LLM_REPLAY_LATENCY is the simulated latency per replayed call: "recorded"
+(the default) sleeps as long as the real call took, a number sleeps that
+many seconds, and 0 replays as fast as possible.
+"""
+import base64
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from openai.types import CreateEmbeddingResponse
+from openai.types.chat import ChatCompletion
+from openai.types.responses import Response
+
+
+load_dotenv()
+
+LLM_REPLAY = os.getenv("LLM_REPLAY", "off")
+LLM_CASSETTE_DIR = os.getenv("LLM_CASSETTE_DIR", ".cache/cassettes")
+LLM_REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "recorded")
+
+RESPONSE_TYPES = {
+    "responses": Response,
+    "chat": ChatCompletion,
+    "embeddings": CreateEmbeddingResponse,
+}
+
+# Arguments that do not change the answer.
+IGNORED_ARGS = ("timeout",)
+
+
+class CassetteMiss(RuntimeError):
+    pass
+
+
+def request_key(kind: str, kwargs: dict) -> str:
+    args = {k: v for k, v in kwargs.items() if k not in IGNORED_ARGS}
+
+    blob = json.dumps(
+        [kind, args],
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def pack(kind: str, body: dict) -> dict:
+    if kind == "embeddings":
+        for item in body["data"]:
+            vector = np.asarray(item["embedding"], dtype=np.float32)
+            item["embedding"] = base64.b64encode(vector.tobytes()).decode("ascii")
+
+    return body
+
+
+def unpack(kind: str, body: dict):
+    if kind == "embeddings":
+        body = dict(body)
+        body["data"] = [
+            {
+                **item,
+                "embedding": np.frombuffer(
+                    base64.b64decode(item["embedding"]), dtype=np.float32
+                ).tolist(),
+            }
+            for item in body["data"]
+        ]
+
+    return RESPONSE_TYPES[kind].model_validate(body)
+
+
+class Cassette:
+
+    def __init__(self, path: str, mode: str):
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+
+        self.entries: Dict[str, dict] = {}
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+
+        if mode == "replay":
+            self._load()
+            self._file = None
+        else:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            # Each run appends a gzip member; gzip reads them back as one stream.
+            self._file = gzip.open(path, "at", encoding="utf-8")
+
+    def _load(self):
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.entries[entry["key"]] = entry
+        except FileNotFoundError:
+            raise CassetteMiss(f"Fant ingen kassett: {self.path}")
+        except EOFError:
+            # The last member of a recording that was cut off.
+            pass
+
+    def record(self, kind: str, key: str, response, seconds: float):
+        entry = {
+            "key": key,
+            "kind": kind,
+            "seconds": round(seconds, 4),
+            "response": pack(kind, response.model_dump(mode="json")),
+        }
+
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+        with self.lock:
+            self._file.write(line)
+            self.recorded += 1
+
+    def replay(self, kind: str, key: str):
+        entry = self.entries.get(key)
+
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if entry is None:
+            raise CassetteMiss(f"Ingen opptak for {kind}-kall {key[:12]}")
+
+        if LLM_REPLAY_LATENCY == "recorded":
+            delay = entry["seconds"]
+        else:
+            delay = float(LLM_REPLAY_LATENCY)
+
+        if delay > 0:
+            time.sleep(delay)
+
+        return unpack(kind, entry["response"])
+
+    def call(self, kind: str, create: Callable, kwargs: dict):
+        key = request_key(kind, kwargs)
+
+        if self.mode == "replay":
+            return self.replay(kind, key)
+
+        start = time.perf_counter()
+        response = create(**kwargs)
+        self.record(kind, key, response, time.perf_counter() - start)
+
+        return response
+
+    def summary(self) -> str:
+        if self.mode == "replay":
+            return f"Kassett {self.path}: {self.hits} spilt av, {self.misses} mangler"
+
+        return f"Kassett {self.path}: {self.recorded} tatt opp"
+
+    def close(self):
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def wrap(client, name: str, mode: str = LLM_REPLAY):
+    """The client itself when mode is off, else a stand-in with the same
+    calls. In replay mode client may be None."""
+    if mode == "off":
+        return client
+
+    if mode not in ("record", "replay"):
+        raise ValueError(f"Ugyldig LLM_REPLAY: {mode}")
+
+    cassette = Cassette(os.path.join(LLM_CASSETTE_DIR, f"{name}.jsonl.gz"), mode)
+
+    def endpoint(kind: str, create: Optional[Callable]) -> Callable:
+        return lambda **kwargs: cassette.call(kind, create, kwargs)
+
+    def method(*path) -> Optional[Callable]:
+        target = client
+
+        for attr in path:
+            if target is None:
+                return None
+            target = getattr(target, attr)
+
+        return target
+
+    return SimpleNamespace(
+        responses=SimpleNamespace(
+            create=endpoint("responses", method("responses", "create")),
+        ),
+        chat=SimpleNamespace(
+            completions=SimpleNamespace(
+                create=endpoint("chat", method("chat", "completions", "create")),
+            ),
+        ),
+        embeddings=SimpleNamespace(
+            create=endpoint("embeddings", method("embeddings", "create")),
+        ),
+        cassette=cassette,
+    )
+
+
+def connect(make: Callable[[], Any], name: str, mode: str = LLM_REPLAY):
+    """wrap(make(), name), without calling make() in replay mode."""
+    return wrap(None if mode == "replay" else make(), name, mode)
+
+
+def close(client):
+    """Flush and report the cassette behind a wrapped client, if any."""
+    cassette = getattr(client, "cassette", None)
+
+    if cassette is None:
+        return
+
+    cassette.close()
+    print(cassette.summary())
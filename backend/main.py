@@ -1,16 +1,68 @@
+import hmac
 import os
+import threading
+import time
+import traceback
+from contextlib import asynccontextmanager
 from typing import List, Optional
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Response
+from fastapi.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from dotenv import load_dotenv
 import psycopg
 from psycopg.rows import dict_row
-from query import get_answer
+import cache
+import profiling
+from query import SNAPSHOT_DIR, get_answer, get_conn
 
 load_dotenv()
 
-app = FastAPI(title="Studieveileder API")
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "5"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+_ready = threading.Event()
+_stopping = threading.Event()
+_started_at = time.time()
+
+
+def warm_up():
+    while not _stopping.is_set():
+        try:
+            start = time.perf_counter()
+            if DATABASE_URL:
+                get_conn()
+            failed = cache.warm_up()
+            print(f"[startup] cache varmet opp på {time.perf_counter() - start:.2f}s")
+
+            # Optional caches are retried on first use.
+            for name, e in failed.items():
+                print(f"[startup] {name} ble ikke lastet:")
+                traceback.print_exception(e)
+
+            _ready.set()
+            return
+        except Exception:
+            print("[startup] oppvarming feilet:")
+            traceback.print_exc()
+            _stopping.wait(WARMUP_RETRY_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up in the background so the worker accepts liveness probes
+    # even while the database is slow or unreachable.
+    _stopping.clear()
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    cache.start_listener()
+    yield
+    _stopping.set()
+    cache.stop_listener()
+
+
+app = FastAPI(title="Studieveileder API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,13 +76,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-DATABASE_URL = os.getenv("DATABASE_URL")
-
+if profiling.ENABLED:
+    app.add_middleware(profiling.ProfilerMiddleware)
 
 def get_db():
     return psycopg.connect(DATABASE_URL, row_factory=dict_row)
 
 
+def require_admin(token: Optional[str]):
+    if not ADMIN_TOKEN or not token or not hmac.compare_digest(
+        token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")
+    ):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
 class ChatRequest(BaseModel):
     query: str
 
@@ -52,14 +111,45 @@ def root():
         "endpoints": [
             "GET /api/courses",
             "GET /api/course/{kode}",
-            "POST /api/chat"
+            "GET /api/grades?emnekode=&year=",
+            "POST /api/chat",
+            "GET /health/live",
+            "GET /health/ready",
         ]
     }
 
 
+@app.get("/health/live")
+def health_live():
+    return {"status": "ok", "uptime": round(time.time() - _started_at, 1)}
+
+
+@app.get("/health/ready")
+def health_ready():
+    if not _ready.is_set():
+        raise HTTPException(status_code=503, detail="Warming up")
+
+    if DATABASE_URL:
+        try:
+            with get_conn().cursor() as cur:
+                cur.execute("SELECT 1")
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f"Database unavailable: {e}")
+
+    return {"status": "ready", "cache": cache.stats()}
+
+
 @app.get("/api/courses")
+@profiling.stage("courses")
 def get_courses():
     try:
+        if SNAPSHOT_DIR:
+            data = cache.get("snapshot").emner_json()
+            return Response(
+                content='{"success":true,"data":' + data + "}",
+                media_type="application/json",
+            )
+
         with get_db() as conn:
             with conn.cursor() as cur:
                 cur.execute("SELECT * FROM emner")
@@ -74,15 +164,19 @@ def get_courses():
 
 
 @app.get("/api/course/{kode}")
+@profiling.stage("course")
 def get_course(kode: str):
     try:
-        with get_db() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT * FROM emner WHERE emnekode = %s",
-                    (kode.upper(),)
-                )
-                data = cur.fetchone()
+        if SNAPSHOT_DIR:
+            data = cache.get("snapshot").emne(kode.upper())
+        else:
+            with get_db() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "SELECT * FROM emner WHERE emnekode = %s",
+                        (kode.upper(),)
+                    )
+                    data = cur.fetchone()
 
         if not data:
             raise HTTPException(status_code=404, detail=f"Course {kode} not found")
@@ -97,6 +191,36 @@ def get_course(kode: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/grades")
+@profiling.stage("grades")
+def get_grades(emnekode: str, year: int):
+    try:
+        if SNAPSHOT_DIR:
+            data = cache.get("snapshot").grades(emnekode.upper(), year)
+        else:
+            with get_db() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "SELECT * FROM eksamensresultater WHERE emnekode = %s AND ar = %s",
+                        (emnekode.upper(), year)
+                    )
+                    data = cur.fetchone()
+
+        if not data:
+            return {
+                "success": True,
+                "data": None,
+                "message": "Ingen karakterdata for valgt år"
+            }
+
+        return {
+            "success": True,
+            "data": data
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.post("/api/chat")
 def chat(request: ChatRequest):
     try:
@@ -112,6 +236,28 @@ def chat(request: ChatRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/admin/profiles")
+def list_profiles(x_admin_token: Optional[str] = Header(default=None)):
+    require_admin(x_admin_token)
+
+    return {
+        "enabled": profiling.ENABLED,
+        "data": profiling.list_captures()
+    }
+
+
+@app.get("/admin/profiles/{capture_id}")
+def get_profile(capture_id: str, x_admin_token: Optional[str] = Header(default=None)):
+    require_admin(x_admin_token)
+
+    path = profiling.capture_path(capture_id)
+
+    if not path:
+        raise HTTPException(status_code=404, detail=f"Capture {capture_id} not found")
+
+    return FileResponse(path, media_type="application/json", filename=f"{capture_id}.json")
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,10 +1,17 @@
 import os
 import re
+import sys
+import time
+import hashlib
 import unicodedata
+import numpy as np
 import pandas as pd
+import openpyxl
 from difflib import SequenceMatcher
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import psycopg
 from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
 from dotenv import load_dotenv
 
 
@@ -17,14 +24,61 @@ if not DATABASE_URL:
 
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.append(os.path.dirname(BASE_DIR))
+
+from changes import publish_change
+
 GRADES_DIR = os.path.join(BASE_DIR, "grades")
 
+# Parsed sheets as .npz, keyed by the workbook's hash. Bump SHEET_FORMAT
+# when parsing or normalize() changes so cached sheets are rebuilt.
+SHEET_CACHE_DIR = os.path.join(os.path.dirname(BASE_DIR), ".cache", "grades")
+SHEET_FORMAT = "1"
+
+# Columns 2-9 of a sheet, in order.
+GRADE_COLUMNS = ["A", "B", "C", "D", "E", "F", "bestatt", "ikke_bestatt"]
+
+RESULT_COLUMNS = [
+    "emnekode",
+    "emnenavn",
+    "ar",
+    "prosent_a",
+    "prosent_b",
+    "prosent_c",
+    "prosent_d",
+    "prosent_e",
+    "prosent_f",
+    "prosent_bestatt",
+    "prosent_ikke_bestatt",
+]
+
+# Year files are parsed and matched in parallel, one process per file.
+MAX_PROCESSES = int(os.getenv("GRADE_PROCESSES", str(os.cpu_count() or 4)))
+
 EMNER_TABLE = "emner"
 RESULT_TABLE = "eksamensresultater"
 
+# Normalized sheet name -> every emne scoring at least MATCH_THRESHOLD
+# against it (treff: [{"emnekode", "score"}]), shared by all years and
+# runs. That is all match_emne needs: a course's row in a sheet is its
+# best-scoring name there. A fuzzy entry holds while its candidate emner
+# (kandidat_hash) are unchanged, since no other emne can reach the
+# threshold; changing one course re-matches only the names near it. A
+# correction is made by editing treff and setting metode = 'manual',
+# review = false; manual entries are never overwritten.
+MATCH_TABLE = "emnenavn_match"
+
 YEAR_REGEX = re.compile(r"(\d{4})")
 MATCH_THRESHOLD = 0.85
 
+# Matches below this are used but flagged for review.
+REVIEW_THRESHOLD = 0.92
+
+# Every character normalize() can leave; anything else shares the last slot.
+ALPHABET = "abcdefghijklmnopqrstuvwxyz0123456789 "
+CHAR_SLOT = {c: i for i, c in enumerate(ALPHABET)}
+
 
 def get_conn():
     return psycopg.connect(DATABASE_URL, row_factory=dict_row)
@@ -68,8 +122,90 @@ def fetch_emner():
     ]
 
 
+def file_hash(path: str) -> str:
+
+    h = hashlib.sha256(SHEET_FORMAT.encode("utf-8"))
+
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+
+    return h.hexdigest()
+
+
+def read_sheet(path: str) -> dict:
+
+    names = []
+    values = []
+
+    # Read-only mode streams rows instead of building the whole workbook.
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+
+    try:
+        # Row 1 is the header pd.read_excel used for column names.
+        for r in wb.worksheets[0].iter_rows(min_row=2, values_only=True):
+
+            if not r or r[0] is None or r[0] == "":
+                continue
+
+            names.append(str(r[0]))
+            values.append((tuple(r[1:9]) + (None,) * 8)[:8])
+    finally:
+        wb.close()
+
+    grades = (
+        pd.DataFrame(values, columns=GRADE_COLUMNS)
+        .apply(pd.to_numeric, errors="coerce")
+        .to_numpy(dtype=np.float64)
+        .reshape(len(values), len(GRADE_COLUMNS))
+    )
+
+    raw = np.array(names, dtype=str)
+
+    # Names repeat within a sheet; each distinct one is normalized once.
+    unique, inverse = np.unique(raw, return_inverse=True)
+    norm = np.array([normalize(u) for u in unique.tolist()], dtype=str)[inverse]
+
+    return {"raw_name": raw, "norm": norm, "grades": grades}
+
+
+def load_sheet(path: str) -> dict:
+
+    cache = os.path.join(SHEET_CACHE_DIR, f"{file_hash(path)}.npz")
+
+    try:
+        with np.load(cache, allow_pickle=False) as data:
+            return {k: data[k] for k in data.files}
+    except (FileNotFoundError, ValueError, OSError):
+        pass
+
+    sheet = read_sheet(path)
+
+    os.makedirs(SHEET_CACHE_DIR, exist_ok=True)
+
+    tmp = f"{cache}.{os.getpid()}.tmp.npz"
+    np.savez(tmp, **sheet)
+    os.replace(tmp, cache)
+
+    return sheet
+
+
 def parse_excel(path: str):
 
+    sheet = load_sheet(path)
+
+    return [
+        {"raw_name": name, "norm": norm, **dict(zip(GRADE_COLUMNS, grades))}
+        for name, norm, grades in zip(
+            sheet["raw_name"].tolist(),
+            sheet["norm"].tolist(),
+            sheet["grades"].tolist(),
+        )
+    ]
+
+
+def parse_excel_pandas(path: str):
+
     df = pd.read_excel(path)
 
     df = df.rename(columns={
@@ -107,7 +243,76 @@ def parse_excel(path: str):
     return rows
 
 
-def match_emne(emne, excel_rows):
+def char_counts(text: str) -> np.ndarray:
+    counts = np.zeros(len(ALPHABET) + 1, dtype=np.int32)
+
+    for c in text:
+        counts[CHAR_SLOT.get(c, len(ALPHABET))] += 1
+
+    return counts
+
+
+class NameIndex:
+    """
+    Candidate blocking for match_emne over one sheet's rows.
+
+    SequenceMatcher.ratio() is 2 * M / (len(a) + len(b)), and the matched
+    characters M can never exceed the characters the two names have in
+    common (difflib's quick_ratio bound). That bound is computed for all
+    rows at once from a character count matrix, and only rows where it
+    reaches the threshold are scored, so the result is the same as scoring
+    every row. Each row keeps a SequenceMatcher with the row as seq2, whose
+    lookup table is then built once instead of once per comparison.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+
+        self.counts = np.zeros((len(rows), len(ALPHABET) + 1), dtype=np.int32)
+        for i, r in enumerate(rows):
+            self.counts[i] = char_counts(r["norm"])
+
+        self.lengths = np.array([len(r["norm"]) for r in rows], dtype=np.int64)
+        self.matchers = [SequenceMatcher(None, "", r["norm"]) for r in rows]
+
+    def candidates(self, norm: str, threshold: float = MATCH_THRESHOLD) -> np.ndarray:
+        common = np.minimum(self.counts, char_counts(norm)).sum(axis=1)
+        total = self.lengths + len(norm)
+
+        # Same arithmetic as difflib's ratio, so a row scoring exactly the
+        # threshold is never filtered out; two empty names score 1.0.
+        bound = np.where(total > 0, 2.0 * common / np.maximum(total, 1), 1.0)
+
+        return np.flatnonzero(bound >= threshold)
+
+    def score(self, i: int, norm: str) -> float:
+        matcher = self.matchers[i]
+        matcher.set_seq1(norm)
+        return matcher.ratio()
+
+
+def match_emne(emne, index: NameIndex):
+
+    best = None
+    best_score = 0.0
+
+    # Candidates come in row order, so ties go to the first row as in a
+    # full scan. Below the threshold best_score only covers the candidates.
+    for i in index.candidates(emne["norm"]):
+
+        score = index.score(i, emne["norm"])
+
+        if score > best_score:
+            best_score = score
+            best = index.rows[i]
+
+    if best_score >= MATCH_THRESHOLD:
+        return best, best_score
+
+    return None, best_score
+
+
+def match_emne_scan(emne, excel_rows):
 
     best = None
     best_score = 0.0
@@ -126,97 +331,326 @@ def match_emne(emne, excel_rows):
     return None, best_score
 
 
-def dedupe(rows):
+def name_matches(norm: str, index: NameIndex) -> list:
 
-    unique = {}
+    treff = []
 
-    for r in rows:
-        key = (r["emnekode"], r["ar"])
+    # Scored as similarity(emne, sheet name), the order match_emne uses.
+    for i in index.candidates(norm):
 
-        if key not in unique:
-            unique[key] = r
+        score = similarity(index.rows[i]["norm"], norm)
 
-    return list(unique.values())
+        if score >= MATCH_THRESHOLD:
+            treff.append({"emnekode": index.rows[i]["emnekode"], "score": score})
 
+    return treff
 
-def insert_rows(rows):
 
-    if not rows:
-        return
+def candidates_hash(norm: str, index: NameIndex) -> str:
+
+    # The emner NameIndex.candidates lets through for norm; every other
+    # emne provably scores below MATCH_THRESHOLD against it.
+    candidates = sorted(
+        (index.rows[i]["emnekode"], index.rows[i]["norm"])
+        for i in index.candidates(norm)
+    )
+
+    h = hashlib.sha256(f"{MATCH_THRESHOLD}\n".encode("utf-8"))
+
+    for code, name in candidates:
+        h.update(f"{code}\0{name}\n".encode("utf-8"))
+
+    return h.hexdigest()
 
-    cols = rows[0].keys()
 
-    columns = ",".join(cols)
-    placeholders = ",".join(["%s"] * len(cols))
-    updates = ",".join(
-        [f"{c}=EXCLUDED.{c}" for c in cols if c not in ("emnekode", "ar")]
+def ensure_match_table(conn):
+
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {MATCH_TABLE} (
+            norm text PRIMARY KEY,
+            navn text NOT NULL,
+            treff jsonb NOT NULL,
+            metode text NOT NULL,
+            kilde text NOT NULL,
+            kandidat_hash text NOT NULL,
+            review boolean NOT NULL DEFAULT false,
+            updated_at timestamptz NOT NULL DEFAULT now()
+        )
+        """
     )
 
-    query = f"""
-    INSERT INTO {RESULT_TABLE} ({columns})
-    VALUES ({placeholders})
-    ON CONFLICT (emnekode, ar)
-    DO UPDATE SET {updates}
-    """
 
-    values = [
-        tuple(r[c] for c in cols)
-        for r in rows
+def load_matches(conn) -> dict:
+
+    # Fuzzy entries are checked against the current emner in match_sheet.
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT norm, navn, treff, metode, kilde, kandidat_hash, review
+            FROM {MATCH_TABLE}
+            """
+        )
+        rows = cur.fetchall()
+
+    return {r["norm"]: r for r in rows}
+
+
+def save_matches(conn, entries):
+
+    if not entries:
+        return
+
+    cols = ("norm", "navn", "treff", "metode", "kilde", "kandidat_hash", "review")
+
+    with conn.cursor() as cur:
+        cur.executemany(
+            f"""
+            INSERT INTO {MATCH_TABLE} ({", ".join(cols)})
+            VALUES ({", ".join(["%s"] * len(cols))})
+            ON CONFLICT (norm) DO UPDATE SET
+                navn = EXCLUDED.navn,
+                treff = EXCLUDED.treff,
+                metode = EXCLUDED.metode,
+                kilde = EXCLUDED.kilde,
+                kandidat_hash = EXCLUDED.kandidat_hash,
+                review = EXCLUDED.review,
+                updated_at = now()
+            WHERE {MATCH_TABLE}.metode <> 'manual'
+            """,
+            [
+                tuple(Jsonb(e[c]) if c == "treff" else e[c] for c in cols)
+                for e in entries
+            ],
+        )
+
+    conn.commit()
+
+
+def result_row(emne, year: int, match) -> dict:
+
+    return {
+        "emnekode": emne["emnekode"],
+        "emnenavn": emne["navn"],
+        "ar": year,
+        "prosent_a": match["A"],
+        "prosent_b": match["B"],
+        "prosent_c": match["C"],
+        "prosent_d": match["D"],
+        "prosent_e": match["E"],
+        "prosent_f": match["F"],
+        "prosent_bestatt": match["bestatt"],
+        "prosent_ikke_bestatt": match["ikke_bestatt"],
+    }
+
+
+def match_sheet(excel_rows, year: int, emner, index: NameIndex, known: dict, source: str):
+
+    by_code = {e["emnekode"]: e for e in emner}
+
+    # emnekode -> (score, sheet row): the first best-scoring row, exactly
+    # what match_emne picks.
+    best = {}
+    new = {}
+    valid = {}
+
+    for r in excel_rows:
+
+        norm = r["norm"]
+        entry = valid.get(norm) or new.get(norm)
+
+        if entry is None:
+
+            entry = known.get(norm)
+
+            if entry is not None and entry["metode"] != "manual":
+                kandidat_hash = candidates_hash(norm, index)
+
+                if entry["kandidat_hash"] != kandidat_hash:
+                    entry = None
+            else:
+                kandidat_hash = None
+
+            if entry is not None:
+                valid[norm] = entry
+
+        # Only names whose candidate emner changed, or that were never
+        # seen, are fuzzy matched.
+        if entry is None:
+
+            treff = name_matches(norm, index)
+
+            entry = {
+                "norm": norm,
+                "navn": r["raw_name"],
+                "treff": treff,
+                "metode": "fuzzy",
+                "kilde": source,
+                "kandidat_hash": kandidat_hash or candidates_hash(norm, index),
+                "review": any(t["score"] < REVIEW_THRESHOLD for t in treff),
+            }
+            new[norm] = entry
+
+        for t in entry["treff"]:
+
+            code = t["emnekode"]
+
+            if code not in by_code:
+                continue
+
+            if code not in best or t["score"] > best[code][0]:
+                best[code] = (t["score"], r)
+
+    rows = [
+        result_row(by_code[code], year, r)
+        for code, (_, r) in best.items()
     ]
 
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.executemany(query, values)
-        conn.commit()
+    return rows, list(new.values())
+
+
+def copy_rows(conn, rows) -> int:
+
+    if not rows:
+        return 0
+
+    columns = ", ".join(RESULT_COLUMNS)
+    staging = f"{RESULT_TABLE}_staging"
+    updates = ", ".join(
+        f"{c} = EXCLUDED.{c}" for c in RESULT_COLUMNS if c not in ("emnekode", "ar")
+    )
+
+    with conn.cursor() as cur:
+
+        # Same column types as the target, without its constraints.
+        cur.execute(
+            f"""
+            CREATE TEMP TABLE {staging} ON COMMIT DROP AS
+            SELECT {columns} FROM {RESULT_TABLE} WITH NO DATA
+            """
+        )
+
+        with cur.copy(f"COPY {staging} ({columns}) FROM STDIN") as copy:
+            for r in rows:
+                copy.write_row(tuple(r[c] for c in RESULT_COLUMNS))
+
+        cur.execute(
+            f"""
+            INSERT INTO {RESULT_TABLE} ({columns})
+            SELECT {columns} FROM {staging}
+            ON CONFLICT (emnekode, ar)
+            DO UPDATE SET {updates}
+            """
+        )
+
+        return cur.rowcount
+
+
+# Per-process state for process_year, set once by init_worker.
+_worker = {}
+
+
+def init_worker(emner, known: dict):
+
+    _worker["emner"] = emner
+    _worker["known"] = known
+    _worker["index"] = NameIndex(emner)
+
+
+def process_year(filename: str):
+
+    year = extract_year(filename)
+    excel_rows = parse_excel(os.path.join(GRADES_DIR, filename))
+
+    rows, new = match_sheet(
+        excel_rows,
+        year,
+        _worker["emner"],
+        _worker["index"],
+        _worker["known"],
+        filename,
+    )
+
+    return rows, new
 
 
 def main():
 
+    start = time.perf_counter()
+
     emner = fetch_emner()
-    total_inserted = 0
 
-    for filename in sorted(os.listdir(GRADES_DIR)):
+    with get_conn() as conn:
+        ensure_match_table(conn)
+        known = load_matches(conn)
+        conn.commit()
 
-        if not filename.endswith(".xlsx"):
-            continue
+    print(f"{len(known)} kjente emnenavn fra tidligere kjøringer")
 
-        year = extract_year(filename)
-        path = os.path.join(GRADES_DIR, filename)
+    files = sorted(f for f in os.listdir(GRADES_DIR) if f.endswith(".xlsx"))
 
-        print(f"Processing {filename} ({year})")
+    results = {}
+    new = {}
+    failed = 0
 
-        excel_rows = parse_excel(path)
-        rows_to_insert = []
+    # Years only share the match table loaded above, so each worker
+    # matches its own new names; the slowest file bounds the run.
+    with ProcessPoolExecutor(
+        max_workers=max(1, min(MAX_PROCESSES, len(files))),
+        initializer=init_worker,
+        initargs=(emner, known),
+    ) as pool:
 
-        for emne in emner:
+        futures = {pool.submit(process_year, f): f for f in files}
 
-            match, score = match_emne(emne, excel_rows)
+        for future in as_completed(futures):
 
-            if not match:
+            filename = futures[future]
+
+            try:
+                rows, entries = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"[ERROR] {filename}: {e}")
                 continue
 
-            rows_to_insert.append({
-                "emnekode": emne["emnekode"],
-                "emnenavn": emne["navn"],
-                "ar": year,
-                "prosent_a": match["A"],
-                "prosent_b": match["B"],
-                "prosent_c": match["C"],
-                "prosent_d": match["D"],
-                "prosent_e": match["E"],
-                "prosent_f": match["F"],
-                "prosent_bestatt": match["bestatt"],
-                "prosent_ikke_bestatt": match["ikke_bestatt"],
-            })
+            for r in rows:
+                results.setdefault((r["emnekode"], r["ar"]), r)
+
+            # A name new in several years keeps the earliest sheet as kilde.
+            for entry in entries:
+                if entry["norm"] not in new or entry["kilde"] < new[entry["norm"]]["kilde"]:
+                    new[entry["norm"]] = entry
 
-        rows_to_insert = dedupe(rows_to_insert)
+            print(f"Processed {filename}: {len(rows)} rows | {len(entries)} nye navn")
 
-        insert_rows(rows_to_insert)
+    with get_conn() as conn:
 
-        print(f"Inserted {len(rows_to_insert)} rows")
+        save_matches(conn, list(new.values()))
+
+        total_inserted = copy_rows(conn, list(results.values()))
+
+        if total_inserted:
+            publish_change(conn, RESULT_TABLE)
+
+        conn.commit()
+
+    print(
+        f"Done in {time.perf_counter() - start:.1f}s. "
+        f"Total rows inserted: {total_inserted} | failed files: {failed}"
+    )
+
+    flagged = sorted(
+        (e for e in new.values() if e["review"]),
+        key=lambda e: e["navn"],
+    )
 
-        total_inserted += len(rows_to_insert)
+    if flagged:
+        print(f"{len(flagged)} nye treff under {REVIEW_THRESHOLD} bør sjekkes ({MATCH_TABLE}.review):")
 
-    print(f"Done. Total rows inserted: {total_inserted}")
+        for e in flagged[:20]:
+            treff = ", ".join(f"{t['emnekode']} ({t['score']:.3f})" for t in e["treff"])
+            print(f"  {e['navn']!r} -> {treff}")
 
 
 if __name__ == "__main__":
@@ -1,7 +1,12 @@
 import os
+import sys
 import psycopg
 from dotenv import load_dotenv
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from changes import publish_change
+
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -93,6 +98,8 @@ def main():
 
     insert_studies(rows)
 
+    publish_change(conn, "studier")
+
     print(f"La inn {len(rows)} studier")
 
 
@@ -1,4 +1,5 @@
 import os
+import sys
 import json
 import re
 import psycopg
@@ -7,14 +8,21 @@ from dotenv import load_dotenv
 from openai import OpenAI
 from pypdf import PdfReader
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import llm_replay
+from changes import publish_change
+from journal import RunJournal, hash_file
+
 load_dotenv()
 
 PDF_FOLDER = "parsing-python/studieplaner"
+MODEL = "gpt-4.1-mini"
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+client = llm_replay.connect(lambda: OpenAI(api_key=OPENAI_API_KEY), "subjects_courses_relation")
 
 conn = psycopg.connect(DATABASE_URL, row_factory=dict_row)
 conn.autocommit = True
@@ -101,7 +109,7 @@ def extract_json(text: str) -> dict:
 
 def openai_call(system_prompt: str, user_text: str, filename: str) -> dict:
     response = client.responses.create(
-        model="gpt-4.1-mini",
+        model=MODEL,
         input=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_text[:12000]},
@@ -185,11 +193,11 @@ def get_emne_id(emnekode):
         return res["id"] if res else None
 
 
-def insert_fag(studie_id, spes_id, studieaar, fag):
+def insert_fag(studie_id, spes_id, studieaar, fag) -> bool:
     emne_id = get_emne_id(fag["emnekode"])
 
     if not emne_id:
-        return
+        return False
 
     with get_cursor() as cur:
         cur.execute(
@@ -217,8 +225,10 @@ def insert_fag(studie_id, spes_id, studieaar, fag):
             ),
         )
 
+    return True
 
-def process_pdf(path: str):
+
+def process_pdf(path: str) -> dict:
     filename = os.path.basename(path)
     text = read_pdf(path)
 
@@ -226,6 +236,8 @@ def process_pdf(path: str):
 
     studie_id = get_studie_id(doc["studie"], doc["type"])
 
+    counts = {"spesialiseringer": 0, "fag": 0}
+
     for spes in doc["spesialiseringer"]:
         spes_id = get_spes_id(studie_id, spes["navn"])
 
@@ -235,17 +247,21 @@ def process_pdf(path: str):
             f"{filename}::{spes['navn']}",
         )
 
+        counts["spesialiseringer"] += 1
+
         for block in data["struktur"]:
             for fag in block["fag"]:
-                insert_fag(
+                counts["fag"] += insert_fag(
                     studie_id,
                     spes_id,
                     block["studieaar"],
                     fag,
                 )
 
+    return counts
+
 
-def main():
+def main(only_failed: bool = False):
     pdfs = [
         f for f in os.listdir(PDF_FOLDER)
         if f.lower().endswith(".pdf")
@@ -253,13 +269,39 @@ def main():
 
     print(f"Fant {len(pdfs)} studieplaner")
 
+    # A plan is redone when the PDF, a prompt or the model changes; "started"
+    # means the run stopped inside it, so it is redone too.
+    journal = RunJournal("subjects_courses_relation")
+    changed = False
+
     for pdf in pdfs:
+        path = os.path.join(PDF_FOLDER, pdf)
+        h = hash_file(path, SYSTEM_PROMPT_STEP_1, SYSTEM_PROMPT_STEP_2, MODEL)
+
+        if not journal.should_run(pdf, h, only_failed):
+            continue
+
+        journal.started(pdf, h)
+
         try:
             print(f"→ Leser {pdf}")
-            process_pdf(os.path.join(PDF_FOLDER, pdf))
+            counts = process_pdf(path)
+            journal.done(pdf, h, **counts)
         except Exception as e:
+            journal.failed(pdf, h, e)
             print(f"[ERROR] {pdf}: {e}")
 
+        # Even a failed plan may have written some rows.
+        changed = True
+
+    if changed:
+        publish_change(conn, "studier")
+        publish_change(conn, "studiefag")
+
+    print(journal.summary())
+    journal.close()
+    llm_replay.close(client)
+
 
 if __name__ == "__main__":
-    main()
+    main(only_failed="--failed" in sys.argv)
@@ -1,28 +1,55 @@
 import os
 import re
+import sys
 import json
 import time
-from typing import Optional
+from collections import deque
+from typing import Dict, Optional, Tuple
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import psycopg
 from openai import OpenAI
 from dotenv import load_dotenv
 
+import llm_replay
+from changes import publish_change
+from journal import RunJournal, hash_file
+from llm_cache import ResponseCache, cache_key
+from ratelimit import AdaptiveConcurrency, call_with_backoff
 
-MAX_WORKERS = 6
+
+# Concurrent LLM calls start at START_WORKERS and adapt between 1 and
+# MAX_WORKERS as responses succeed or get throttled.
+START_WORKERS = 6
+MAX_WORKERS = int(os.getenv("POPULATE_MAX_WORKERS", "32"))
+MODEL = "gpt-4.1-mini"
 SUBJECT_FOLDER = "parsing-python/subject_contents"
 
+# Results are upserted this many rows at a time, and committed at least
+# this often (seconds) so a crash loses little paid-for LLM output.
+UPSERT_BATCH = 200
+UPSERT_INTERVAL = 30
+
+# Throughput is reported over the courses finished in this many seconds.
+RATE_WINDOW = 60
+
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-if not DATABASE_URL or not OPENAI_API_KEY:
+# A replayed run answers from the cassette and needs no key.
+if not DATABASE_URL or (not OPENAI_API_KEY and llm_replay.LLM_REPLAY != "replay"):
     raise ValueError("Missing required environment variables")
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Retries are ours (call_with_backoff), so every 429 reaches the controller.
+client = llm_replay.connect(
+    lambda: OpenAI(api_key=OPENAI_API_KEY, max_retries=0),
+    "populate_db",
+)
+llm_cache = ResponseCache()
+concurrency = AdaptiveConcurrency(START_WORKERS, maximum=MAX_WORKERS)
 
 
 FIELDS = {
@@ -43,6 +70,55 @@ FIELDS = {
 }
 
 
+# The same fields for parse_file, located with substring searches instead
+# of lazy regex scans. Line fields take the rest of the line after the
+# label; sections run from the heading to the nearest terminator, or to the
+# end of the line where the pattern ended in "$" (MULTILINE).
+NAVN_PATTERN = re.compile(FIELDS["navn"], re.MULTILINE)
+
+LINE_FIELDS = {
+    "studiepoeng": "Studiepoeng:",
+    "semester": "Undervisnings- og vurderingsperiode:",
+    "fakultet": "Ansvarlig fakultet:",
+    "underviser": "Emneansvarlig:",
+    "språk": "Undervisningens språk:",
+    "antall_plasser": "Antall plasser:",
+}
+
+# field: (heading, skipped after it, terminators, stop at line end). None
+# skips nothing, "" whitespace, ":" whitespace and colons.
+SECTION_FIELDS: Dict[str, Tuple[str, Optional[str], Tuple[str, ...], bool]] = {
+    "dette_lærer_du": (
+        "Dette lærer du", None,
+        ("Læringsaktiviteter", "Pensum", "Forutsatte forkunnskaper"), False,
+    ),
+    "forkunnskaper": (
+        "Forutsatte forkunnskaper", ":",
+        ("Vurderingsordning", "Obligatorisk", "Merknader", "Undervisningstider"), True,
+    ),
+    "læringsaktiviteter": (
+        "Læringsaktiviteter", None,
+        ("Læringsstøtte", "Pensum", "Forutsatte forkunnskaper"), False,
+    ),
+    "vurderingsordning": (
+        "Vurderingsordning, hjelpemiddel og eksamen", None,
+        ("Om bruk av KI", "Sensorordning", "Obligatorisk aktivitet"), False,
+    ),
+    "obligatoriske_aktiviteter": (
+        "Obligatorisk aktivitet", "",
+        ("Merknader", "Undervisningstimer", "Opptakskrav"), True,
+    ),
+    "merknader": (
+        "Merknader", "",
+        ("Undervisningstider", "Opptakskrav"), True,
+    ),
+    "fortrinnsrett": (
+        "Fortrinnsrett", "",
+        ("Opptakskrav", "Merknader"), True,
+    ),
+}
+
+
 SYSTEM_PROMPT = """
 Du er studieplanredaktør ved NMBU.
 
@@ -65,10 +141,8 @@ def clean_text(text: Optional[str]) -> Optional[str]:
     if not text:
         return None
 
-    text = re.sub(r"\n\s*\n+", "\n", text)
-    text = re.sub(r"\s+", " ", text)
-
-    return text.strip()
+    # Same as collapsing every whitespace run to one space, then strip().
+    return " ".join(text.split())
 
 
 def normalize_integer(value):
@@ -111,7 +185,7 @@ def normalize_semester(value):
     return None
 
 
-def parse_file(filepath: str) -> dict:
+def parse_file_regex(filepath: str) -> dict:
 
     with open(filepath, "r", encoding="utf-8") as f:
         content = f.read()
@@ -129,6 +203,110 @@ def parse_file(filepath: str) -> dict:
     return data
 
 
+def skip(content: str, pos: int, chars: str) -> int:
+
+    while pos < len(content) and (content[pos].isspace() or content[pos] in chars):
+        pos += 1
+
+    return pos
+
+
+def line_end(content: str, pos: int) -> int:
+
+    end = content.find("\n", pos)
+
+    return len(content) if end < 0 else end
+
+
+def rest_of_line(content: str, start: int) -> Optional[str]:
+
+    # Label followed by \s*(.+)
+    pos = skip(content, start, "")
+
+    if pos < len(content):
+        return content[pos:line_end(content, pos)]
+
+    # Only whitespace left: the regex backs off to the last character
+    # that is not a newline.
+    for pos in range(len(content) - 1, start - 1, -1):
+        if content[pos] != "\n":
+            return content[pos:line_end(content, pos)]
+
+    return None
+
+
+def section(content: str, field: str) -> Optional[str]:
+
+    heading, chars, terminators, until_eol = SECTION_FIELDS[field]
+
+    # Only the first heading can match: any later one sees fewer terminators.
+    found = content.find(heading)
+
+    if found < 0:
+        return None
+
+    start = found + len(heading)
+
+    if chars is not None:
+        start = skip(content, start, chars)
+
+        if start == len(content):
+            # Greedy skip backs off one character to give the group a match.
+            if start - 1 < found + len(heading):
+                return None
+            start -= 1
+
+    if start >= len(content):
+        return None
+
+    # The group is at least one character. Each terminator is only looked
+    # for before the nearest end found so far.
+    end = line_end(content, start + 1) if until_eol else None
+
+    for t in terminators:
+        limit = len(content) if end is None else end + len(t) - 1
+        hit = content.find(t, start + 1, limit)
+        if hit >= 0:
+            end = hit
+
+    if end is None:
+        return None
+
+    return content[start:end]
+
+
+def parse_file(filepath: str) -> dict:
+
+    with open(filepath, "r", encoding="utf-8") as f:
+        content = f.read()
+
+    data = {
+        "emnekode": os.path.splitext(os.path.basename(filepath))[0]
+    }
+
+    m = NAVN_PATTERN.search(content)
+    data["navn"] = clean_text(m.group(1)) if m else None
+
+    for key, label in LINE_FIELDS.items():
+
+        value = None
+        p = content.find(label)
+
+        while p >= 0:
+            value = rest_of_line(content, p + len(label))
+            if value is not None:
+                break
+            p = content.find(label, p + 1)
+
+        data[key] = clean_text(value)
+
+    for key in SECTION_FIELDS:
+        data[key] = clean_text(section(content, key))
+
+    # Same key order as FIELDS.
+    return {"emnekode": data["emnekode"], **{k: data[k] for k in FIELDS}}
+
+
 def extract_json(text: str) -> dict:
 
     match = re.search(r"\{[\s\S]*\}", text)
@@ -141,11 +319,16 @@ def extract_json(text: str) -> dict:
 
 def improve_with_openai(data: dict) -> dict:
 
-    for _ in range(3):
+    key = cache_key(MODEL, SYSTEM_PROMPT, data)
+    cached = llm_cache.get(key)
 
-        try:
-            response = client.responses.create(
-                model="gpt-4.1-mini",
+    if cached is not None:
+        return extract_json(cached)
+
+    def call():
+        with concurrency.slot():
+            return client.responses.create(
+                model=MODEL,
                 input=[
                     {"role": "system", "content": SYSTEM_PROMPT},
                     {"role": "user", "content": json.dumps(data, ensure_ascii=False)},
@@ -153,96 +336,143 @@ def improve_with_openai(data: dict) -> dict:
                 timeout=60,
             )
 
-            return extract_json(response.output_text)
+    # Rate limits and timeouts are retried inside call_with_backoff; this
+    # loop only asks again when the answer is not valid JSON.
+    for _ in range(3):
+
+        response = call_with_backoff(call)
+
+        try:
+            improved = extract_json(response.output_text)
+        except ValueError:
+            continue
+
+        # Only stored once it parses, so a bad answer is retried next run.
+        llm_cache.put(key, MODEL, response.output_text, response.usage)
 
-        except Exception:
-            time.sleep(5)
+        return improved
 
-    raise RuntimeError("OpenAI failed")
+    raise RuntimeError("OpenAI returned no valid JSON")
 
 
-def is_done(conn, emnekode: str) -> bool:
+def done_codes(conn) -> set:
 
     with conn.cursor() as cur:
 
-        cur.execute(
-            "SELECT processed_at FROM emner WHERE emnekode = %s",
-            (emnekode,)
-        )
-
-        row = cur.fetchone()
-
-        return row is not None and row[0] is not None
-
-
-def update_emne(conn, data: dict):
-
-    sql = """
-        INSERT INTO emner (
-            emnekode,
-            navn,
-            studiepoeng,
-            semester,
-            fakultet,
-            underviser,
-            språk,
-            antall_plasser,
-            dette_lærer_du,
-            forkunnskaper,
-            læringsaktiviteter,
-            vurderingsordning,
-            obligatoriske_aktiviteter,
-            merknader,
-            fortrinnsrett,
-            updated_at,
-            processed_at
-        )
-        VALUES (
-            %s, %s, %s, %s, %s, %s, %s, %s,
-            %s, %s, %s, %s, %s, %s, %s,
-            NOW(),
-            NOW()
-        )
+        cur.execute("SELECT emnekode FROM emner WHERE processed_at IS NOT NULL")
+
+        return {row[0] for row in cur.fetchall()}
+
+
+EMNE_COLUMNS = [
+    "emnekode",
+    "navn",
+    "studiepoeng",
+    "semester",
+    "fakultet",
+    "underviser",
+    "språk",
+    "antall_plasser",
+    "dette_lærer_du",
+    "forkunnskaper",
+    "læringsaktiviteter",
+    "vurderingsordning",
+    "obligatoriske_aktiviteter",
+    "merknader",
+    "fortrinnsrett",
+]
+
+
+def upsert_sql(rows: int, table: str = "emner") -> str:
+
+    columns = ", ".join(EMNE_COLUMNS)
+    placeholders = ", ".join(["%s"] * len(EMNE_COLUMNS))
+    values = ",\n            ".join([f"({placeholders}, NOW(), NOW())"] * rows)
+
+    updates = ",\n            ".join(f"{c} = EXCLUDED.{c}" for c in EMNE_COLUMNS[1:])
+
+    return f"""
+        INSERT INTO {table} ({columns}, updated_at, processed_at)
+        VALUES
+            {values}
         ON CONFLICT (emnekode)
         DO UPDATE SET
-            navn = EXCLUDED.navn,
-            studiepoeng = EXCLUDED.studiepoeng,
-            semester = EXCLUDED.semester,
-            fakultet = EXCLUDED.fakultet,
-            underviser = EXCLUDED.underviser,
-            språk = EXCLUDED.språk,
-            antall_plasser = EXCLUDED.antall_plasser,
-            dette_lærer_du = EXCLUDED.dette_lærer_du,
-            forkunnskaper = EXCLUDED.forkunnskaper,
-            læringsaktiviteter = EXCLUDED.læringsaktiviteter,
-            vurderingsordning = EXCLUDED.vurderingsordning,
-            obligatoriske_aktiviteter = EXCLUDED.obligatoriske_aktiviteter,
-            merknader = EXCLUDED.merknader,
-            fortrinnsrett = EXCLUDED.fortrinnsrett,
+            {updates},
             updated_at = NOW(),
             processed_at = NOW();
     """
 
-    values = (
-        data.get("emnekode"),
-        data.get("navn"),
-        data.get("studiepoeng"),
-        data.get("semester"),
-        data.get("fakultet"),
-        data.get("underviser"),
-        data.get("språk"),
-        data.get("antall_plasser"),
-        data.get("dette_lærer_du"),
-        data.get("forkunnskaper"),
-        data.get("læringsaktiviteter"),
-        data.get("vurderingsordning"),
-        data.get("obligatoriske_aktiviteter"),
-        data.get("merknader"),
-        data.get("fortrinnsrett"),
-    )
+
+def upsert_emner(conn, rows: list, table: str = "emner"):
+
+    # ON CONFLICT cannot touch the same row twice in one statement.
+    unique = {data.get("emnekode"): data for data in rows}
+
+    if not unique:
+        return
+
+    params = [
+        data.get(c)
+        for data in unique.values()
+        for c in EMNE_COLUMNS
+    ]
 
     with conn.cursor() as cur:
-        cur.execute(sql, values)
+        cur.execute(upsert_sql(len(unique), table), params)
+
+
+def update_emne(conn, data: dict, table: str = "emner"):
+
+    upsert_emner(conn, [data], table)
+
+
+def write_batch(conn, batch: list) -> Dict[str, str]:
+
+    try:
+
+        upsert_emner(conn, batch)
+        conn.commit()
+
+        return {}
+
+    except Exception as e:
+
+        conn.rollback()
+        print(f"[ERROR] batch på {len(batch)} emner: {e}; prøver enkeltvis")
+
+    failures = {}
+
+    for data in batch:
+
+        try:
+
+            update_emne(conn, data)
+            conn.commit()
+
+        except Exception as e:
+
+            conn.rollback()
+
+            failures[data.get("emnekode")] = str(e)
+            print(f"[ERROR] {data.get('emnekode')}: {e}")
+
+    return failures
+
+
+def write_results(conn, batch: list, journal: RunJournal, hashes: dict) -> Tuple[int, int]:
+
+    failures = write_batch(conn, batch)
+
+    for data in batch:
+
+        code = data["emnekode"]
+
+        if code in failures:
+            journal.failed(code, hashes[code], failures[code])
+        else:
+            journal.done(code, hashes[code])
+
+    return len(batch) - len(failures), len(failures)
 
 
 def process_file(filepath: str) -> dict:
@@ -277,7 +507,7 @@ def format_eta(seconds):
     return f"{m}m {s}s"
 
 
-def main():
+def main(only_failed: bool = False):
 
     files = [
         os.path.join(SUBJECT_FOLDER, f)
@@ -293,21 +523,43 @@ def main():
 
     print(f"Starter prosessering av {total} emner")
 
+    # processed_at says what is stored; the journal adds what was skipped
+    # for too little content or failed, keyed by the file's hash.
+    journal = RunJournal("populate_db")
+    hashes = {}
+
     with psycopg.connect(DATABASE_URL) as conn:
 
+        done = done_codes(conn)
+        conn.commit()
+
         pending = []
 
         for f in files:
 
             code = os.path.splitext(os.path.basename(f))[0]
+            h = hash_file(f)
+
+            if only_failed:
+                run = journal.should_run(code, h, only_failed=True)
+            else:
+                # A journal "done" does not count: clearing processed_at
+                # is how a reprocessing is forced.
+                run = code not in done and journal.state(code, h) != "skipped"
 
-            if not is_done(conn, code):
+            if run:
                 pending.append(f)
+                hashes[code] = h
             else:
                 skipped += 1
 
         print(f"Gjenstår: {len(pending)} | Hopper over: {skipped}")
 
+        batch = []
+        last_write = time.time()
+
+        finished = deque()
+
         with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
 
             futures = {
@@ -318,6 +570,7 @@ def main():
             for idx, future in enumerate(as_completed(futures), 1):
 
                 filename = futures[future]
+                code = os.path.splitext(os.path.basename(filename))[0]
 
                 try:
 
@@ -325,33 +578,66 @@ def main():
 
                     if result["status"] == "skipped":
                         skipped += 1
+                        journal.skipped(code, hashes[code], "for lite innhold")
                         continue
 
-                    update_emne(conn, result["data"])
-                    conn.commit()
-
-                    processed += 1
+                    batch.append(result["data"])
 
                 except Exception as e:
 
                     failed += 1
+                    journal.failed(code, hashes[code], e)
                     print(f"[ERROR] {filename}: {e}")
 
-                elapsed = time.time() - start_time
-                avg = elapsed / max(1, idx)
-                eta = avg * (len(pending) - idx)
+                if batch and (
+                    len(batch) >= UPSERT_BATCH
+                    or time.time() - last_write >= UPSERT_INTERVAL
+                ):
+                    ok, bad = write_results(conn, batch, journal, hashes)
+                    processed += ok
+                    failed += bad
+
+                    batch = []
+                    last_write = time.time()
+
+                now = time.time()
+                finished.append(now)
+
+                while finished[0] < now - RATE_WINDOW:
+                    finished.popleft()
+
+                window = min(RATE_WINDOW, now - start_time)
+                per_minute = len(finished) / max(window, 1) * 60
+                eta = (len(pending) - idx) / max(per_minute, 1e-9) * 60
 
                 print(
                     f"[{idx}/{len(pending)}] "
-                    f"ok={processed} skip={skipped} fail={failed} "
+                    f"ok={processed} skip={skipped} fail={failed} | "
+                    f"{per_minute:.1f} emner/min | "
+                    f"workers={concurrency.current} | "
                     f"ETA {format_eta(eta)}"
                 )
 
+        if batch:
+            ok, bad = write_results(conn, batch, journal, hashes)
+            processed += ok
+            failed += bad
+
+        if processed:
+            publish_change(conn, "emner")
+
     print(
         f"Ferdig på {format_eta(time.time() - start_time)} | "
         f"ok={processed} skip={skipped} fail={failed}"
     )
+    print(journal.summary())
+    print(llm_cache.summary())
+    print(f"Throttling: {concurrency.throttles} | workers ved slutt: {concurrency.current}")
+
+    llm_cache.close()
+    journal.close()
+    llm_replay.close(client)
 
 
 if __name__ == "__main__":
-    main()
+    main(only_failed="--failed" in sys.argv)
@@ -0,0 +1,303 @@
+"""
+Opt-in sampling profiler for slow or sampled API requests.
+
+Enabled when PROFILE_SAMPLE_RATE > 0 or PROFILE_SLOW_MS is set. While a
+request is in flight a single background thread samples the Python stacks
+of the threads serving it every PROFILE_INTERVAL_MS. The request is kept if
+it was picked by the sample rate or took longer than the threshold, and is
+written as JSON (collapsed stacks, request parameters, per-stage timings)
+to PROFILE_DIR, keeping the newest PROFILE_MAX_CAPTURES files. Stacks are
+only attributed to the threads that entered one of the request's stages,
+since other threads may be serving other requests. stage() doubles as a
+decorator, so a sync endpoint wrapped in it is sampled as a whole; requests
+without stages keep just their timings.
+"""
+import contextvars
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set
+
+import anyio
+
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", ".profiles")
+PROFILE_MAX_CAPTURES = int(os.getenv("PROFILE_MAX_CAPTURES", "200"))
+PROFILE_MAX_BODY = 4096
+
+ENABLED = PROFILE_SAMPLE_RATE > 0 or PROFILE_SLOW_MS > 0
+
+# Threads parked in these files are idle pool workers or the event loop
+# waiting for I/O, not request work.
+IDLE_FILES = ("threading.py", "selectors.py", "queue.py", "thread.py")
+
+
+class Capture:
+
+    def __init__(self, method: str, path: str, query: str):
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.method = method
+        self.path = path
+        self.query = query
+        self.body = b""
+        self.status: Optional[int] = None
+        self.sampled = random.random() < PROFILE_SAMPLE_RATE
+        self.started = time.perf_counter()
+        self.threads: Set[int] = set()
+        self.stages: Dict[str, float] = {}
+        self.stacks: Dict[str, int] = {}
+        self.samples = 0
+
+    def add_stage(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds * 1000
+
+
+_current: contextvars.ContextVar[Optional[Capture]] = contextvars.ContextVar(
+    "profile_capture", default=None
+)
+
+
+def current() -> Optional[Capture]:
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str):
+    capture = _current.get()
+
+    if capture is None:
+        yield
+        return
+
+    capture.threads.add(threading.get_ident())
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        capture.add_stage(name, time.perf_counter() - start)
+
+
+class Sampler:
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.active: Dict[str, Capture] = {}
+        self.labels: Dict[object, str] = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self, capture: Capture):
+        with self.lock:
+            self.active[capture.id] = capture
+
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run,
+                    name="profile-sampler",
+                    daemon=True,
+                )
+                self.thread.start()
+
+        self.wakeup.set()
+
+    def stop(self, capture: Capture):
+        with self.lock:
+            self.active.pop(capture.id, None)
+
+    def label(self, code) -> str:
+        label = self.labels.get(code)
+
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self.labels[code] = label
+
+        return label
+
+    def collapse(self, frame) -> Optional[str]:
+        if os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+            return None
+
+        labels: List[str] = []
+
+        while frame is not None:
+            labels.append(self.label(frame.f_code))
+            frame = frame.f_back
+
+        return ";".join(reversed(labels))
+
+    def run(self):
+        me = threading.get_ident()
+
+        while True:
+            if not self.active:
+                self.wakeup.clear()
+                if not self.active:
+                    self.wakeup.wait()
+
+            time.sleep(self.interval)
+
+            with self.lock:
+                captures = list(self.active.values())
+
+            if not captures:
+                continue
+
+            stacks = {}
+
+            for tid, frame in sys._current_frames().items():
+                if tid != me:
+                    stacks[tid] = self.collapse(frame)
+
+            for capture in captures:
+                # Only the threads that ran the request's stages are known
+                # to be working on it.
+                if not capture.threads:
+                    continue
+
+                for tid in capture.threads:
+                    stack = stacks.get(tid)
+                    if stack:
+                        capture.stacks[stack] = capture.stacks.get(stack, 0) + 1
+
+                capture.samples += 1
+
+
+_sampler = Sampler(PROFILE_INTERVAL_MS / 1000)
+
+
+def _rotate():
+    files = sorted(
+        f for f in os.listdir(PROFILE_DIR)
+        if f.endswith(".json")
+    )
+
+    for f in files[:-PROFILE_MAX_CAPTURES]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, f))
+        except FileNotFoundError:
+            pass
+
+
+def save(capture: Capture, duration_ms: float, reason: str):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+
+    body = capture.body[:PROFILE_MAX_BODY].decode("utf-8", errors="replace")
+
+    data = {
+        "id": capture.id,
+        "reason": reason,
+        "method": capture.method,
+        "path": capture.path,
+        "query": capture.query,
+        "body": body,
+        "status": capture.status,
+        "duration_ms": round(duration_ms, 2),
+        "stages_ms": {k: round(v, 2) for k, v in capture.stages.items()},
+        "interval_ms": PROFILE_INTERVAL_MS,
+        "samples": capture.samples,
+        "stacks": dict(sorted(capture.stacks.items(), key=lambda kv: -kv[1])),
+    }
+
+    tmp = os.path.join(PROFILE_DIR, f".{capture.id}.tmp")
+
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+    os.replace(tmp, os.path.join(PROFILE_DIR, f"{capture.id}.json"))
+    _rotate()
+
+
+def list_captures() -> List[dict]:
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+
+    out = []
+
+    for f in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if not f.endswith(".json"):
+            continue
+
+        try:
+            with open(os.path.join(PROFILE_DIR, f), encoding="utf-8") as fh:
+                d = json.load(fh)
+        except (OSError, ValueError):
+            continue
+
+        out.append({
+            "id": d["id"],
+            "reason": d["reason"],
+            "method": d["method"],
+            "path": d["path"],
+            "status": d["status"],
+            "duration_ms": d["duration_ms"],
+            "stages_ms": d["stages_ms"],
+        })
+
+    return out
+
+
+def capture_path(capture_id: str) -> Optional[str]:
+    path = os.path.join(PROFILE_DIR, f"{os.path.basename(capture_id)}.json")
+    return path if os.path.isfile(path) else None
+
+
+class ProfilerMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(("/admin", "/health")):
+            await self.app(scope, receive, send)
+            return
+
+        capture = Capture(
+            scope["method"],
+            scope["path"],
+            scope.get("query_string", b"").decode("latin-1"),
+        )
+
+        async def receive_tee():
+            message = await receive()
+            if message["type"] == "http.request" and len(capture.body) < PROFILE_MAX_BODY:
+                capture.body += message.get("body", b"")
+            return message
+
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                capture.status = message["status"]
+            await send(message)
+
+        token = _current.set(capture)
+        _sampler.start(capture)
+
+        try:
+            await self.app(scope, receive_tee, send_status)
+        finally:
+            _sampler.stop(capture)
+            _current.reset(token)
+
+            duration_ms = (time.perf_counter() - capture.started) * 1000
+
+            reason = None
+            if PROFILE_SLOW_MS and duration_ms >= PROFILE_SLOW_MS:
+                reason = "slow"
+            elif capture.sampled:
+                reason = "sampled"
+
+            if reason:
+                try:
+                    # File writes and rotation stay off the event loop.
+                    await anyio.to_thread.run_sync(save, capture, duration_ms, reason)
+                except OSError as e:
+                    print(f"[profiling] kunne ikke lagre {capture.id}: {e}")
@@ -1,37 +1,82 @@
 import os
 import re
+import threading
 from typing import List, Tuple, Optional, Dict
 
+import numpy as np
 import psycopg
 from psycopg.rows import dict_row
+from pgvector.psycopg import register_vector
 
-from openai import OpenAI
 from dotenv import load_dotenv
 
+import cache
+import snapshot
+import tracing
+import vector_index
+import vectors
+
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-if not DATABASE_URL:
-    raise ValueError("Missing DATABASE_URL")
 
-if not OPENAI_API_KEY:
-    raise ValueError("Missing OPENAI_API_KEY")
+_init_lock = threading.Lock()
+_openai_client = None
+_conn: Optional[psycopg.Connection] = None
+
+
+def get_openai_client():
+    global _openai_client
+
+    if _openai_client is None:
+        if not OPENAI_API_KEY:
+            raise ValueError("Missing OPENAI_API_KEY")
+
+        # The openai package is slow to import; keep it off the boot path.
+        from openai import OpenAI
+
+        with _init_lock:
+            if _openai_client is None:
+                _openai_client = OpenAI(
+                    api_key=OPENAI_API_KEY,
+                    timeout=30.0,
+                )
+
+    return _openai_client
+
+
+def get_conn() -> psycopg.Connection:
+    global _conn
+
+    if _conn is None or _conn.closed:
+        if not DATABASE_URL:
+            raise ValueError("Missing DATABASE_URL")
+
+        with _init_lock:
+            if _conn is None or _conn.closed:
+                conn = psycopg.connect(
+                    DATABASE_URL,
+                    row_factory=dict_row,
+                    connect_timeout=10,
+                )
+                conn.autocommit = True
+                register_vector(conn)
+
+                # The tuned ef_search/probes only matter when
+                # match_embeddings searches in SQL.
+                if not (CACHE_VECTORS or SNAPSHOT_DIR):
+                    vector_index.apply_search_settings(conn)
 
+                _conn = conn
 
-openai_client = OpenAI(
-    api_key=OPENAI_API_KEY,
-    timeout=30.0,
-)
+    return _conn
 
-conn = psycopg.connect(
-    DATABASE_URL,
-    row_factory=dict_row,
-)
-conn.autocommit = True
 
+CACHE_VECTORS = os.getenv("CACHE_VECTORS", "1") != "0"
+SNAPSHOT_DIR = snapshot.SNAPSHOT_DIR
 
 EMNEKODE_REGEX = re.compile(r"\b[A-ZÆØÅ]{2,4}\d{3,4}\b")
 
@@ -56,35 +101,101 @@ def extract_emnekoder(text: str) -> List[str]:
     return list(set(EMNEKODE_REGEX.findall(text.upper())))
 
 
+def load_studies() -> List[str]:
+    with get_conn().cursor() as cur:
+        cur.execute("SELECT navn FROM studier")
+        rows = cur.fetchall()
+    return [r["navn"] for r in rows]
+
+
+def load_emner() -> Dict[str, dict]:
+    with get_conn().cursor() as cur:
+        cur.execute("SELECT * FROM emner")
+        rows = cur.fetchall()
+    return {r["emnekode"]: r for r in rows}
+
+
+def load_vectors() -> Tuple[List[str], np.ndarray]:
+    with get_conn().cursor() as cur:
+        cur.execute("SELECT text, embedding::vector AS embedding FROM embeddings")
+        rows = cur.fetchall()
+
+    if not rows:
+        return [], np.zeros((0, 0), dtype=np.float32)
+
+    matrix = vectors.compact(vectors.normalize(np.vstack([vectors.as_array(r["embedding"]) for r in rows])))
+
+    return [r["text"] for r in rows], matrix
+
+
+cache.use_connection(get_conn)
+
+if SNAPSHOT_DIR:
+    # All workers map the same published snapshot instead of holding
+    # their own copies; swapped when a new generation is announced.
+    cache.register("snapshot", ("snapshot", "snapshot_file"), snapshot.open_current)
+    cache.register_source("snapshot_file", snapshot.current_generation)
+else:
+    cache.register("studies", ("studier",), load_studies)
+    cache.register("emner", ("emner",), load_emner)
+
+    if CACHE_VECTORS:
+        # match_embeddings falls back to SQL while this is not loaded.
+        cache.register("vectors", ("embeddings",), load_vectors, critical=False)
+
+cache.register("emne_blocks", ("emner", "snapshot", "snapshot_file"), lambda: {})
+
+
 def fetch_all_studies() -> List[str]:
     try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT navn FROM studier")
-            rows = cur.fetchall()
-        return [r["navn"] for r in rows]
+        if SNAPSHOT_DIR:
+            return cache.get("snapshot").studies()
+        return cache.get("studies")
     except Exception:
         return []
 
 
 def fetch_emne(emnekode: str) -> Optional[dict]:
     try:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT * FROM emner WHERE emnekode = %s",
-                (emnekode,),
-            )
-            return cur.fetchone()
+        if SNAPSHOT_DIR:
+            return cache.get("snapshot").emne(emnekode)
+        return cache.get("emner").get(emnekode)
     except Exception:
         return None
 
 
+def search_vectors(embedding: list, limit: int) -> List[str]:
+    if SNAPSHOT_DIR:
+        return cache.get("snapshot").search(embedding, limit)
+
+    texts, matrix = cache.get("vectors")
+
+    return [texts[i] for i in vectors.top_k(matrix, embedding, limit)]
+
+
 def match_embeddings(embedding: list, limit: int = 8) -> List[str]:
+    if CACHE_VECTORS or SNAPSHOT_DIR:
+        try:
+            return search_vectors(embedding, limit)
+        except Exception:
+            pass
+
     try:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT text FROM match_embeddings(%s::vector, %s)",
-                (embedding, limit),
-            )
+        with get_conn().cursor() as cur:
+            if vectors.EMBEDDING_STORAGE == "vector":
+                cur.execute(
+                    "SELECT text FROM match_embeddings(%s::vector, %s)",
+                    (embedding, limit),
+                )
+            else:
+                cur.execute(
+                    f"""
+                    SELECT text FROM embeddings
+                    ORDER BY embedding <=> %s::{vectors.EMBEDDING_STORAGE}
+                    LIMIT %s
+                    """,
+                    (embedding, limit),
+                )
             rows = cur.fetchall()
         return [r["text"] for r in rows]
     except Exception:
@@ -148,22 +259,43 @@ def classify_intent(
 
 def fetch_rules_context(query: str) -> List[str]:
     try:
-        emb = openai_client.embeddings.create(
+        with tracing.span(
+            "embed_query",
             model="text-embedding-3-small",
-            input=query,
-        ).data[0].embedding
+            dimensions=vectors.EMBEDDING_DIMENSIONS,
+        ):
+            emb = get_openai_client().embeddings.create(
+                model="text-embedding-3-small",
+                input=query,
+                dimensions=vectors.EMBEDDING_DIMENSIONS,
+            ).data[0].embedding
+
+        with tracing.span("match_embeddings", limit=10) as sp:
+            matches = match_embeddings(emb, 10)
+            sp.set("matches", len(matches))
 
-        matches = match_embeddings(emb, 10)
         return [f"[REGLER]\n{text}" for text in matches]
     except Exception:
         return []
 
 
 def fetch_emne_block(emnekode: str) -> Optional[str]:
-    r = fetch_emne(emnekode)
-    if not r:
-        return None
+    blocks = cache.get("emne_blocks")
+    block = blocks.get(emnekode)
+
+    # Only blocks that were found are kept: the codes come from user
+    # questions, and a failed lookup must not hide the course later. The
+    # cache is thus bounded by the emner table.
+    if block is None:
+        r = fetch_emne(emnekode)
+
+        if r:
+            block = blocks[emnekode] = format_emne_block(r)
 
+    return block
+
+
+def format_emne_block(r: dict) -> str:
     return "\n".join([
         "[EMNE]",
         f"Emnekode: {r['emnekode']}",
@@ -204,9 +336,17 @@ def trim_context(blocks: List[str], max_chars: int) -> str:
 
 
 def build_context(question: str) -> Tuple[str, str, Dict[str, int | str]]:
-    emnekoder = extract_emnekoder(question)
-    studies = extract_study_mentions(question)
-    intent = classify_intent(question, emnekoder, studies)
+    with tracing.span("extract_emnekoder") as sp:
+        emnekoder = extract_emnekoder(question)
+        sp.set("emnekoder", ",".join(emnekoder))
+
+    with tracing.span("extract_study_mentions") as sp:
+        studies = extract_study_mentions(question)
+        sp.set("studies", len(studies))
+
+    with tracing.span("classify_intent") as sp:
+        intent = classify_intent(question, emnekoder, studies)
+        sp.set("intent", intent)
 
     blocks: List[str] = []
 
@@ -218,16 +358,24 @@ def build_context(question: str) -> Tuple[str, str, Dict[str, int | str]]:
         "conditional_rule",
         "progression_consequence",
     }:
-        blocks.extend(fetch_rules_context(question))
+        with tracing.span("fetch_rules_context") as sp:
+            rules = fetch_rules_context(question)
+            sp.set("blocks", len(rules))
+        blocks.extend(rules)
 
     if intent == "specific_emne":
         for e in emnekoder:
-            b = fetch_emne_block(e)
+            with tracing.span("fetch_emne_block", emnekode=e) as sp:
+                b = fetch_emne_block(e)
+                sp.set("found", b is not None)
             if b:
                 blocks.append(b)
 
     policy = INTENT_POLICY[intent]
-    context = trim_context(blocks, policy["max_context_chars"])
+
+    with tracing.span("trim_context", blocks=len(blocks)) as sp:
+        context = trim_context(blocks, policy["max_context_chars"])
+        sp.set("context_chars", len(context))
 
     return context, intent, policy
 
@@ -246,30 +394,44 @@ Regler:
 
 
 def get_answer(question: str) -> str:
-    try:
-        context, intent, policy = build_context(question)
-
-        if intent == "off_topic":
-            return "Jeg kan kun svare på spørsmål om studier, emner og regler ved universitetet."
-
-        if not context:
-            return "Jeg finner ingen relevant informasjon i regelverket til å svare på dette."
-
-        r = openai_client.chat.completions.create(
-            model=policy["model"],
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {
-                    "role": "user",
-                    "content": f"KONTEKST:\n{context}\n\nSPØRSMÅL:\n{question}"
-                },
-            ],
-        )
-
-        return r.choices[0].message.content.strip()
-
-    except Exception as e:
-        return f"Feil: {str(e)}"
+    with tracing.span("get_answer", question_chars=len(question)) as root:
+        try:
+            with tracing.span("build_context") as sp:
+                context, intent, policy = build_context(question)
+                sp.set("intent", intent)
+                sp.set("context_chars", len(context))
+
+            root.set("intent", intent)
+            root.set("model", policy["model"])
+
+            if intent == "off_topic":
+                return "Jeg kan kun svare på spørsmål om studier, emner og regler ved universitetet."
+
+            if not context:
+                return "Jeg finner ingen relevant informasjon i regelverket til å svare på dette."
+
+            with tracing.span("completion", model=policy["model"]) as sp:
+                r = get_openai_client().chat.completions.create(
+                    model=policy["model"],
+                    messages=[
+                        {"role": "system", "content": SYSTEM_PROMPT},
+                        {
+                            "role": "user",
+                            "content": f"KONTEKST:\n{context}\n\nSPØRSMÅL:\n{question}"
+                        },
+                    ],
+                )
+
+                if r.usage:
+                    sp.set("prompt_tokens", r.usage.prompt_tokens)
+                    sp.set("completion_tokens", r.usage.completion_tokens)
+                    sp.set("total_tokens", r.usage.total_tokens)
+
+            return r.choices[0].message.content.strip()
+
+        except Exception as e:
+            root.set("error", str(e))
+            return f"Feil: {str(e)}"
 
 
 def main():
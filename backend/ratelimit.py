@@ -0,0 +1,189 @@
+import email.utils
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional, TypeVar
+
+import openai
+
+
+T = TypeVar("T")
+
+RETRYABLE = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+# The errors that mean "slow down", as opposed to a flaky connection.
+THROTTLED = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+)
+
+
+class RateLimiter:
+    """Token buckets for requests and tokens per minute, shared by threads."""
+
+    def __init__(self, rpm: float, tpm: float):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = rpm
+        self.tokens = tpm
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+
+        self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+
+    def acquire(self, tokens: int = 0):
+        # A single call larger than the bucket would wait forever.
+        tokens = min(tokens, self.tpm)
+
+        while True:
+            with self.lock:
+                self._refill()
+
+                if self.requests >= 1 and self.tokens >= tokens:
+                    self.requests -= 1
+                    self.tokens -= tokens
+                    return
+
+                wait = max(
+                    (1 - self.requests) * 60 / self.rpm,
+                    (tokens - self.tokens) * 60 / self.tpm,
+                )
+
+            time.sleep(max(wait, 0.01))
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    # Full jitter: uniform in [0, min(cap, base * 2^attempt)].
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry_after(exc: Exception) -> Optional[float]:
+    """Seconds the server asked us to wait, from retry-after-ms or Retry-After."""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+
+    if not headers:
+        return None
+
+    ms = headers.get("retry-after-ms")
+    value = headers.get("retry-after")
+
+    try:
+        if ms:
+            return float(ms) / 1000
+        if value:
+            return float(value)
+    except ValueError:
+        pass
+
+    if not value:
+        return None
+
+    # Retry-After may also be an HTTP date.
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0.0, when.timestamp() - time.time())
+
+
+def call_with_backoff(
+    fn: Callable[[], T],
+    retries: int = 6,
+    base: float = 1.0,
+    cap: float = 60.0,
+) -> T:
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except RETRYABLE as e:
+            if attempt == retries:
+                raise
+
+            delay = backoff_delay(attempt, base, cap)
+
+            # Never retry before the server said to; the jitter keeps
+            # threads throttled together from returning together.
+            hint = retry_after(e)
+            if hint is not None:
+                delay = max(delay, hint + random.uniform(0, base))
+
+            time.sleep(delay)
+
+    raise RuntimeError("unreachable")
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit on concurrent calls, shared by threads.
+
+    Every successful call raises the limit by 1 / limit, so about one step
+    per round of calls; a throttled call halves it, and any other failure
+    (connection errors, 5xx) leaves it unchanged. Calls that were already in
+    flight when the limit was cut report the same overload, so further
+    throttles within the cooldown do not cut it again.
+    """
+
+    def __init__(self, start: int, minimum: int = 1, maximum: int = 32, cooldown: float = 5.0):
+        self.limit = float(start)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.throttles = 0
+        self.decreased = 0.0
+        self.cond = threading.Condition()
+
+    @property
+    def current(self) -> int:
+        return int(self.limit)
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled: bool = False, succeeded: bool = True):
+        with self.cond:
+            self.in_flight -= 1
+
+            if throttled:
+                self.throttles += 1
+                now = time.monotonic()
+
+                if now - self.decreased >= self.cooldown:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self.decreased = now
+            elif succeeded:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+            self.cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """Hold one slot for a single call; retries should wait outside it."""
+        self.acquire()
+        throttled = False
+        succeeded = False
+
+        try:
+            yield
+            succeeded = True
+        except THROTTLED:
+            throttled = True
+            raise
+        finally:
+            self.release(throttled, succeeded)
@@ -0,0 +1,407 @@
+"""
+Read-only snapshots of the reference data, shared by all API workers.
+
+A snapshot generation is a directory with the normalized embedding matrix
+(vectors.npy in VECTOR_DTYPE, plus per-row scales.npy for int8) and a
+compact SQLite store (store.sqlite) holding emner, studier, studiefag,
+eksamensresultater and the chunk texts. Workers map both read-only, so
+the pages live once in the OS page cache no matter how many processes use
+them. A new generation is written next to the old ones and published by
+atomically replacing the CURRENT pointer file.
+
+    python snapshot.py publish       # build a generation from Postgres
+    python snapshot.py watch         # rebuild whenever ingestion publishes
+    python snapshot.py export PATH   # standalone snapshot, no Postgres needed
+
+SNAPSHOT_DIR may point at a publish root (with CURRENT) or directly at an
+exported snapshot; the API then serves reads without a database.
+"""
+import fcntl
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import psycopg
+from psycopg import IsolationLevel
+from psycopg.rows import dict_row
+from pgvector.psycopg import register_vector
+from dotenv import load_dotenv
+from fastapi.encoders import jsonable_encoder
+
+import vectors
+from changes import (
+    CHANNEL,
+    ensure_generations_table,
+    fetch_generations,
+    parse_payload,
+    publish_change,
+)
+
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR")
+
+KEEP_GENERATIONS = 3
+MMAP_SIZE = 256 * 1024 * 1024
+WATCH_DEBOUNCE = 5.0
+
+SOURCE_TABLES = ("emner", "studier", "studiefag", "eksamensresultater", "embeddings")
+
+FORMAT_VERSION = "4"
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE emner (emnekode TEXT PRIMARY KEY, data TEXT NOT NULL) WITHOUT ROWID;
+CREATE TABLE studier (navn TEXT NOT NULL, data TEXT NOT NULL);
+CREATE TABLE studiefag (data TEXT NOT NULL);
+CREATE TABLE eksamensresultater (
+    emnekode TEXT NOT NULL,
+    ar INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (emnekode, ar)
+) WITHOUT ROWID;
+CREATE TABLE embeddings (idx INTEGER PRIMARY KEY, url TEXT, title TEXT, text TEXT NOT NULL);
+"""
+
+
+class Snapshot:
+
+    def __init__(self, path: str):
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            f"file:{os.path.join(path, 'store.sqlite')}?mode=ro&immutable=1",
+            uri=True,
+            check_same_thread=False,
+        )
+        self._db.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+
+        meta = dict(self._query(
+            "SELECT key, value FROM meta WHERE key IN ('generation', 'sources', 'dtype')"
+        ))
+        self.generation = int(meta["generation"])
+        self.sources: Dict[str, int] = json.loads(meta["sources"])
+        self.dtype = meta.get("dtype", "float32")
+
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+
+        if self.dtype == "int8":
+            self.vectors = vectors.Int8Matrix(
+                self.vectors,
+                np.load(os.path.join(path, "scales.npy"), mmap_mode="r"),
+            )
+
+    def _query(self, sql: str, params=()) -> list:
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def emne(self, emnekode: str) -> Optional[dict]:
+        rows = self._query("SELECT data FROM emner WHERE emnekode = ?", (emnekode,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def emner_json(self) -> str:
+        # Pre-serialized at export so the list endpoint skips decoding.
+        return self._query("SELECT value FROM meta WHERE key = 'emner_json'")[0][0]
+
+    def grades(self, emnekode: str, ar: int) -> Optional[dict]:
+        rows = self._query(
+            "SELECT data FROM eksamensresultater WHERE emnekode = ? AND ar = ?",
+            (emnekode, ar),
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    def studies(self) -> List[str]:
+        return [r[0] for r in self._query("SELECT navn FROM studier")]
+
+    def texts(self, indices: List[int]) -> List[str]:
+        if not indices:
+            return []
+
+        placeholders = ",".join("?" * len(indices))
+        rows = dict(self._query(
+            f"SELECT idx, text FROM embeddings WHERE idx IN ({placeholders})",
+            indices,
+        ))
+
+        return [rows[i] for i in indices]
+
+    def search(self, embedding: list, limit: int) -> List[str]:
+        return self.texts(vectors.top_k(self.vectors, embedding, limit))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+        # The mapping is released with the last reference to the arrays.
+        self.vectors = None
+
+
+def current_name(root: str) -> Optional[str]:
+    try:
+        with open(os.path.join(root, "CURRENT"), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def current_generation(root: Optional[str] = None) -> int:
+    name = current_name(root or SNAPSHOT_DIR)
+    return int(name.split("-")[1]) if name else 0
+
+
+def open_current(root: Optional[str] = None) -> Snapshot:
+    root = root or SNAPSHOT_DIR
+
+    if os.path.exists(os.path.join(root, "store.sqlite")):
+        return Snapshot(root)
+
+    name = current_name(root)
+
+    if not name:
+        raise FileNotFoundError(f"No published snapshot in {root}")
+
+    return Snapshot(os.path.join(root, name))
+
+
+def _fsync_dir(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _dump(row: dict) -> str:
+    # Encoded the way FastAPI encodes the same row from Postgres, so the API
+    # answers identically with and without SNAPSHOT_DIR.
+    return json.dumps(jsonable_encoder(row), ensure_ascii=False)
+
+
+def write_snapshot(conn, path: str, generation: int, dtype: str = vectors.VECTOR_DTYPE):
+    tmp = f"{path}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    db = sqlite3.connect(os.path.join(tmp, "store.sqlite"))
+    db.executescript(SCHEMA)
+
+    with conn.cursor() as cur:
+
+        cur.execute("SELECT * FROM emner ORDER BY emnekode")
+        emner = [(r["emnekode"], _dump(r)) for r in cur]
+        db.executemany("INSERT INTO emner VALUES (?, ?)", emner)
+
+        cur.execute("SELECT * FROM studier")
+        db.executemany(
+            "INSERT INTO studier VALUES (?, ?)",
+            ((r["navn"], _dump(r)) for r in cur),
+        )
+
+        cur.execute("SELECT * FROM studiefag")
+        db.executemany("INSERT INTO studiefag VALUES (?)", ((_dump(r),) for r in cur))
+
+        cur.execute("SELECT * FROM eksamensresultater")
+        db.executemany(
+            "INSERT OR REPLACE INTO eksamensresultater VALUES (?, ?, ?)",
+            ((r["emnekode"], r["ar"], _dump(r)) for r in cur),
+        )
+
+        cur.execute(
+            "SELECT count(*) AS n, max(vector_dims(embedding::vector)) AS dims FROM embeddings"
+        )
+        r = cur.fetchone()
+        count, dims = r["n"], r["dims"] or 0
+
+    matrix = np.lib.format.open_memmap(
+        os.path.join(tmp, "vectors.npy"),
+        mode="w+",
+        dtype=np.int8 if dtype == "int8" else np.dtype(dtype),
+        shape=(count, dims),
+    )
+
+    scales = None
+
+    if dtype == "int8":
+        scales = np.lib.format.open_memmap(
+            os.path.join(tmp, "scales.npy"),
+            mode="w+",
+            dtype=np.float32,
+            shape=(count,),
+        )
+
+    # Server-side cursor so the matrix is streamed straight into the file.
+    with conn.cursor(name="snapshot_embeddings") as cur:
+        cur.execute("SELECT url, title, text, embedding::vector AS embedding FROM embeddings")
+
+        for idx, r in enumerate(cur):
+            row = vectors.normalize(vectors.as_array(r["embedding"]))
+
+            if scales is None:
+                matrix[idx] = row
+            else:
+                matrix[idx], scales[idx] = vectors.quantize_int8(row)
+
+            db.execute(
+                "INSERT INTO embeddings VALUES (?, ?, ?, ?)",
+                (idx, r["url"], r["title"], r["text"]),
+            )
+
+    matrix.flush()
+    del matrix
+
+    if scales is not None:
+        scales.flush()
+        del scales
+
+    db.executemany(
+        "INSERT INTO meta VALUES (?, ?)",
+        [
+            ("format", FORMAT_VERSION),
+            ("generation", str(generation)),
+            ("dtype", dtype),
+            ("sources", json.dumps(fetch_generations(conn))),
+            ("created_at", str(time.time())),
+            ("emner_json", "[" + ",".join(d for _, d in emner) + "]"),
+        ],
+    )
+    db.commit()
+    db.execute("VACUUM")
+    db.close()
+
+    for f in os.listdir(tmp):
+        fd = os.open(os.path.join(tmp, f), os.O_RDONLY)
+        os.fsync(fd)
+        os.close(fd)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp, path)
+
+
+def set_current(root: str, name: str):
+    tmp = os.path.join(root, "CURRENT.tmp")
+
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp, os.path.join(root, "CURRENT"))
+    _fsync_dir(root)
+
+
+def prune(root: str, keep: int = KEEP_GENERATIONS):
+    current = current_name(root)
+
+    generations = sorted(
+        d for d in os.listdir(root)
+        if d.startswith("gen-") and not d.endswith(".tmp")
+    )
+
+    # Workers that still map an old generation keep reading it after the
+    # unlink; the pages go away when the last one swaps.
+    for d in generations[:-keep]:
+        if d != current:
+            shutil.rmtree(os.path.join(root, d), ignore_errors=True)
+
+
+def publish(conn, root: str) -> int:
+    os.makedirs(root, exist_ok=True)
+    ensure_generations_table(conn)
+    conn.commit()
+
+    with open(os.path.join(root, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        current = current_name(root)
+        generation = int(current.split("-")[1]) + 1 if current else 1
+
+        start = time.time()
+        name = f"gen-{generation:06d}"
+        write_snapshot(conn, os.path.join(root, name), generation)
+        set_current(root, name)
+        prune(root)
+
+    print(f"Publiserte snapshot {name} på {time.time() - start:.1f}s")
+
+    publish_change(conn, "snapshot")
+
+    return generation
+
+
+def connect():
+    if not DATABASE_URL:
+        raise ValueError("Missing DATABASE_URL")
+
+    conn = psycopg.connect(DATABASE_URL, row_factory=dict_row)
+    # One consistent view of all tables while a generation is written.
+    conn.isolation_level = IsolationLevel.REPEATABLE_READ
+    register_vector(conn)
+
+    return conn
+
+
+def watch(root: str):
+    with connect() as conn, psycopg.connect(DATABASE_URL, autocommit=True) as listener:
+
+        publish(conn, root)
+
+        listener.execute(f"LISTEN {CHANNEL}")
+        print(f"Lytter på {CHANNEL}")
+
+        while True:
+            dirty = False
+
+            for notify in listener.notifies(timeout=WATCH_DEBOUNCE):
+                if parse_payload(notify.payload)["table"] in SOURCE_TABLES:
+                    dirty = True
+
+            if dirty:
+                publish(conn, root)
+
+
+def export(path: str):
+    start = time.time()
+
+    with connect() as conn:
+        ensure_generations_table(conn)
+        conn.commit()
+        write_snapshot(conn, os.path.abspath(path), 1)
+
+    size = sum(
+        os.path.getsize(os.path.join(path, f))
+        for f in os.listdir(path)
+    )
+
+    print(f"Eksporterte snapshot til {path} ({size / 1e6:.1f} MB) på {time.time() - start:.1f}s")
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "export":
+        export(sys.argv[2])
+        return
+
+    if len(sys.argv) < 2 or sys.argv[1] not in {"publish", "watch"}:
+        print("Bruk: python snapshot.py publish|watch|export PATH")
+        sys.exit(1)
+
+    if not SNAPSHOT_DIR:
+        raise ValueError("Missing SNAPSHOT_DIR")
+
+    if sys.argv[1] == "watch":
+        watch(SNAPSHOT_DIR)
+    else:
+        with connect() as conn:
+            publish(conn, SNAPSHOT_DIR)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Span-based tracing of the chat pipeline.
+
+Spans nest through a context variable and are handed to the exporter in one
+batch when the root span ends. The exporter is picked with TRACE_EXPORTER:
+
+    none   (default) spans still feed the profiler's stage timings
+    jsonl  one JSON object per span appended to TRACE_FILE
+    otlp   OTLP/HTTP JSON posted to TRACE_OTLP_ENDPOINT (/v1/traces)
+
+Exporting happens on a background thread, so a slow collector never delays
+a request; use set_exporter() to plug in anything else with export(spans).
+"""
+import contextvars
+import json
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import profiling
+
+
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none")
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "studieveileder-api")
+TRACE_QUEUE_SIZE = 1000
+TRACE_BATCH_TRACES = 200
+
+
+class Span:
+
+    __slots__ = (
+        "trace_id", "span_id", "parent_id", "name",
+        "start_ns", "end_ns", "attributes", "error", "children",
+    )
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.name = name
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        # The root collects every finished span of its trace.
+        self.children: List["Span"] = []
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+
+    def set(self, key: str, value: Any):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "trace_span", default=None
+)
+_root: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "trace_root", default=None
+)
+
+
+class JsonlExporter:
+
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+
+    def export(self, spans: List[Span]):
+        lines = [json.dumps(s.to_dict(), ensure_ascii=False, default=str) for s in spans]
+
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OtlpHttpExporter:
+
+    def __init__(self, endpoint: str = TRACE_OTLP_ENDPOINT, timeout: float = 5.0):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.timeout = timeout
+
+    def payload(self, spans: List[Span]) -> dict:
+        out = []
+
+        for s in spans:
+            span = {
+                "traceId": s.trace_id,
+                "spanId": s.span_id,
+                "name": s.name,
+                "kind": 1,
+                "startTimeUnixNano": str(s.start_ns),
+                "endTimeUnixNano": str(s.end_ns),
+                "attributes": [
+                    {"key": k, "value": _otlp_value(v)}
+                    for k, v in s.attributes.items()
+                ],
+                "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+            }
+            if s.parent_id:
+                span["parentSpanId"] = s.parent_id
+            out.append(span)
+
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    {"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}},
+                ]},
+                "scopeSpans": [{"scope": {"name": "studieveileder"}, "spans": out}],
+            }]
+        }
+
+    def export(self, spans: List[Span]):
+        req = urllib.request.Request(
+            self.url,
+            data=json.dumps(self.payload(spans), default=str).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+
+        with urllib.request.urlopen(req, timeout=self.timeout) as r:
+            r.read()
+
+
+_exporter = None
+_queue: "queue.Queue[List[Span]]" = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+_worker: Optional[threading.Thread] = None
+dropped = 0
+
+
+def _export_loop():
+    while True:
+        batches = [_queue.get()]
+
+        # Drain whatever else is waiting so one write/POST covers many traces.
+        while len(batches) < TRACE_BATCH_TRACES:
+            try:
+                batches.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        try:
+            _exporter.export([s for batch in batches for s in batch])
+        except Exception as e:
+            print(f"[tracing] eksport feilet: {e}")
+        finally:
+            for _ in batches:
+                _queue.task_done()
+
+
+def set_exporter(exporter):
+    global _exporter, _worker
+
+    _exporter = exporter
+
+    if exporter is not None and _worker is None:
+        _worker = threading.Thread(target=_export_loop, name="trace-export", daemon=True)
+        _worker.start()
+
+
+def flush():
+    _queue.join()
+
+
+def _submit(spans: List[Span]):
+    global dropped
+
+    try:
+        _queue.put_nowait(spans)
+    except queue.Full:
+        dropped += len(spans)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    if _exporter is None and profiling.current() is None:
+        yield _NOOP
+        return
+
+    with profiling.stage(name):
+
+        if _exporter is None:
+            yield _NOOP
+            return
+
+        parent = _current.get()
+        s = Span(name, parent, attributes)
+
+        token = _current.set(s)
+        root_token = _root.set(s) if parent is None else None
+
+        try:
+            yield s
+        except BaseException as e:
+            s.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            s.end_ns = time.time_ns()
+            _current.reset(token)
+
+            if root_token is None:
+                root = _root.get()
+                if root is not None:
+                    root.children.append(s)
+            else:
+                _root.reset(root_token)
+                _submit(s.children + [s])
+
+
+if TRACE_EXPORTER == "jsonl":
+    set_exporter(JsonlExporter())
+elif TRACE_EXPORTER == "otlp":
+    set_exporter(OtlpHttpExporter())
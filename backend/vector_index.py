@@ -0,0 +1,408 @@
+"""
+ANN index management for embeddings.embedding.
+
+    python vector_index.py status
+    python vector_index.py build hnsw --m 16 --ef-construction 64 --ef-search 40
+    python vector_index.py build ivfflat --lists 100 --probes 10
+    python vector_index.py sweep [--queries 200] [--k 10] [--target-recall 0.95]
+    python vector_index.py drop
+
+The sweep builds each candidate index, measures recall against an exact
+scan and latency for every search setting, then rebuilds the fastest one
+that reaches the target recall. The chosen index and its search setting
+are stored in vector_index_settings; API connections apply the setting
+when they connect (apply_search_settings), so match_embeddings uses it.
+
+Only the SQL search path uses the index: the API with CACHE_VECTORS=0 and
+no SNAPSHOT_DIR. The in-process cache (the default) and snapshots always
+scan exactly, so there the sweep changes nothing and the settings are not
+applied. status reports which path the API takes with the environment it
+is run with, and build and sweep warn when that path is not SQL.
+"""
+import argparse
+import json
+import math
+import os
+import statistics
+import time
+from typing import Dict, List, Optional
+
+import psycopg
+from pgvector.psycopg import register_vector
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+# Read the same way as query.py, which decides the API's search path.
+CACHE_VECTORS = os.getenv("CACHE_VECTORS", "1") != "0"
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR")
+
+INDEX_NAME = "embeddings_embedding_ann_idx"
+SETTINGS_TABLE = "vector_index_settings"
+
+SEARCH_SETTING = {"hnsw": "hnsw.ef_search", "ivfflat": "ivfflat.probes"}
+
+HNSW_M = (8, 16, 32)
+HNSW_EF_CONSTRUCTION = 64
+HNSW_EF_SEARCH = (10, 20, 40, 80, 160)
+IVFFLAT_PROBES = (1, 2, 4, 8, 16, 32)
+
+# Tuned for this many rows; status suggests a new sweep past the factor.
+RETUNE_GROWTH = 2.0
+
+
+def unused_reason() -> Optional[str]:
+    """Why the API would not search through the index, if it would not."""
+    if SNAPSHOT_DIR:
+        return "SNAPSHOT_DIR er satt; API-et søker i snapshotet"
+
+    if CACHE_VECTORS:
+        return "CACHE_VECTORS er på; API-et søker i minnet"
+
+    return None
+
+
+def warn_unused():
+    reason = unused_reason()
+
+    if reason:
+        print(f"Advarsel: {reason}, så indeksen og innstillingene brukes ikke")
+
+
+def ensure_settings_table(conn):
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {SETTINGS_TABLE} (
+            name text PRIMARY KEY,
+            method text NOT NULL,
+            build jsonb NOT NULL,
+            search jsonb NOT NULL,
+            rows bigint NOT NULL,
+            recall real,
+            p50_ms real,
+            updated_at timestamptz NOT NULL DEFAULT now()
+        )
+        """
+    )
+
+
+def column_type(conn) -> str:
+    row = conn.execute(
+        """
+        SELECT format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = 'embeddings'::regclass AND attname = 'embedding'
+        """
+    ).fetchone()
+
+    # "vector(1536)" -> "vector", "halfvec(512)" -> "halfvec"
+    return row[0].split("(")[0]
+
+
+def count_rows(conn) -> int:
+    return conn.execute("SELECT count(*) FROM embeddings").fetchone()[0]
+
+
+def drop_index(conn):
+    conn.execute(f"DROP INDEX IF EXISTS {INDEX_NAME}")
+
+
+def build_index(conn, method: str, params: Dict[str, int]) -> float:
+    opclass = f"{column_type(conn)}_cosine_ops"
+    options = ", ".join(f"{k} = {int(v)}" for k, v in params.items())
+
+    drop_index(conn)
+
+    start = time.perf_counter()
+    conn.execute(
+        f"CREATE INDEX {INDEX_NAME} ON embeddings "
+        f"USING {method} (embedding {opclass}) WITH ({options})"
+    )
+    conn.execute("ANALYZE embeddings")
+
+    return time.perf_counter() - start
+
+
+def set_search(conn, method: str, value: int):
+    conn.execute(f"SET {SEARCH_SETTING[method]} = {int(value)}")
+
+
+def load_settings(conn) -> Optional[dict]:
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"SELECT method, build, search, rows, recall, p50_ms, updated_at "
+                f"FROM {SETTINGS_TABLE} WHERE name = %s",
+                (INDEX_NAME,),
+            )
+            row = cur.fetchone()
+    except psycopg.errors.UndefinedTable:
+        conn.rollback()
+        return None
+
+    if row is None:
+        return None
+
+    keys = ("method", "build", "search", "rows", "recall", "p50_ms", "updated_at")
+
+    if isinstance(row, dict):
+        return row
+
+    return dict(zip(keys, row))
+
+
+def save_settings(conn, method: str, build: dict, search: dict, rows: int,
+                  recall: Optional[float] = None, p50_ms: Optional[float] = None):
+    ensure_settings_table(conn)
+    conn.execute(
+        f"""
+        INSERT INTO {SETTINGS_TABLE} (name, method, build, search, rows, recall, p50_ms)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (name) DO UPDATE SET
+            method = EXCLUDED.method,
+            build = EXCLUDED.build,
+            search = EXCLUDED.search,
+            rows = EXCLUDED.rows,
+            recall = EXCLUDED.recall,
+            p50_ms = EXCLUDED.p50_ms,
+            updated_at = now()
+        """,
+        (INDEX_NAME, method, json.dumps(build), json.dumps(search), rows, recall, p50_ms),
+    )
+
+
+def apply_search_settings(conn):
+    """Set the tuned ef_search/probes for this session, if any were saved."""
+    settings = load_settings(conn)
+
+    if settings is None:
+        return
+
+    for value in settings["search"].values():
+        set_search(conn, settings["method"], value)
+
+
+def sample_queries(conn, n: int) -> list:
+    return [
+        r[0] for r in conn.execute(
+            "SELECT embedding::vector FROM embeddings ORDER BY random() LIMIT %s",
+            (n,),
+        ).fetchall()
+    ]
+
+
+def search(conn, cast: str, embedding, k: int) -> List[str]:
+    return [
+        r[0] for r in conn.execute(
+            f"SELECT ctid::text FROM embeddings ORDER BY embedding <=> %s::{cast} LIMIT %s",
+            (embedding, k),
+        ).fetchall()
+    ]
+
+
+def exact(conn, cast: str, queries: list, k: int) -> List[set]:
+    conn.execute("SET enable_indexscan = off")
+    try:
+        return [set(search(conn, cast, q, k)) for q in queries]
+    finally:
+        conn.execute("RESET enable_indexscan")
+
+
+def measure(conn, cast: str, queries: list, truth: List[set], k: int) -> dict:
+    latencies = []
+    recalls = []
+
+    for q, expected in zip(queries, truth):
+        start = time.perf_counter()
+        found = search(conn, cast, q, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(expected.intersection(found)) / max(len(expected), 1))
+
+    latencies.sort()
+
+    return {
+        "recall": statistics.mean(recalls),
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+    }
+
+
+def candidates(rows: int) -> List[tuple]:
+    out = [
+        ("hnsw", {"m": m, "ef_construction": HNSW_EF_CONSTRUCTION}, HNSW_EF_SEARCH)
+        for m in HNSW_M
+    ]
+
+    # pgvector's guidance: rows / 1000 lists up to 1M rows, sqrt(rows) above.
+    base = max(1, rows // 1000 if rows <= 1_000_000 else int(math.sqrt(rows)))
+
+    for lists in sorted({max(1, base // 2), base, base * 2}):
+        probes = tuple(p for p in IVFFLAT_PROBES if p <= lists)
+        out.append(("ivfflat", {"lists": lists}, probes))
+
+    return out
+
+
+def sweep(conn, n_queries: int, k: int, target: float, methods: List[str]):
+    cast = column_type(conn)
+    rows = count_rows(conn)
+
+    if rows == 0:
+        print("Ingen embeddings å indeksere")
+        return
+
+    queries = sample_queries(conn, n_queries)
+
+    drop_index(conn)
+    truth = exact(conn, cast, queries, k)
+    baseline = measure(conn, cast, queries, truth, k)
+
+    print(f"{rows} rader, {len(queries)} spørringer, k={k}")
+    print(f"exact scan: p50 {baseline['p50_ms']:.2f} ms | p95 {baseline['p95_ms']:.2f} ms")
+
+    results = []
+
+    for method, build, values in candidates(rows):
+        if method not in methods:
+            continue
+
+        seconds = build_index(conn, method, build)
+        label = " ".join(f"{key}={v}" for key, v in build.items())
+        print(f"{method} {label}: bygget på {seconds:.1f}s")
+
+        for value in values:
+            set_search(conn, method, value)
+            m = measure(conn, cast, queries, truth, k)
+            results.append((method, build, value, m))
+
+            print(
+                f"  {SEARCH_SETTING[method]}={value:<4} "
+                f"recall@{k} {m['recall']:.3f} "
+                f"| p50 {m['p50_ms']:.2f} ms | p95 {m['p95_ms']:.2f} ms"
+            )
+
+        conn.execute(f"RESET {SEARCH_SETTING[method]}")
+
+    good = [r for r in results if r[3]["recall"] >= target]
+
+    if not good:
+        drop_index(conn)
+        print(f"Ingen innstilling nådde recall {target}; beholder exact scan")
+        return
+
+    method, build, value, m = min(good, key=lambda r: r[3]["p50_ms"])
+
+    build_index(conn, method, build)
+    save_settings(
+        conn, method, build, {SEARCH_SETTING[method]: value}, rows,
+        m["recall"], m["p50_ms"],
+    )
+
+    print(
+        f"Valgte {method} {build} {SEARCH_SETTING[method]}={value}: "
+        f"recall {m['recall']:.3f}, p50 {m['p50_ms']:.2f} ms"
+    )
+
+
+def status(conn):
+    rows = count_rows(conn)
+    settings = load_settings(conn)
+
+    index = conn.execute(
+        "SELECT indexdef FROM pg_indexes WHERE indexname = %s",
+        (INDEX_NAME,),
+    ).fetchone()
+
+    reason = unused_reason()
+
+    print(f"rader: {rows}")
+    print(f"indeks: {index[0] if index else 'ingen (exact scan)'}")
+    print(f"søk i API: {'exact scan (' + reason + ')' if reason else 'SQL, via indeksen'}")
+
+    if settings is None:
+        print("innstillinger: ingen lagret")
+        return
+
+    print(
+        f"innstillinger: {settings['method']} {settings['build']} {settings['search']} "
+        f"(recall {settings['recall']}, p50 {settings['p50_ms']} ms, "
+        f"{settings['rows']} rader, {settings['updated_at']})"
+    )
+
+    if settings["rows"] and rows > settings["rows"] * RETUNE_GROWTH:
+        print("Korpuset har vokst siden tuning; kjør sweep på nytt")
+
+
+def connect():
+    if not DATABASE_URL:
+        raise ValueError("Missing DATABASE_URL")
+
+    conn = psycopg.connect(DATABASE_URL, autocommit=True)
+    register_vector(conn)
+
+    return conn
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="vector_index.py")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("status")
+    sub.add_parser("drop")
+
+    build = sub.add_parser("build")
+    build.add_argument("method", choices=sorted(SEARCH_SETTING))
+    build.add_argument("--m", type=int, default=16)
+    build.add_argument("--ef-construction", type=int, default=HNSW_EF_CONSTRUCTION)
+    build.add_argument("--ef-search", type=int, default=40)
+    build.add_argument("--lists", type=int)
+    build.add_argument("--probes", type=int, default=10)
+
+    sw = sub.add_parser("sweep")
+    sw.add_argument("--queries", type=int, default=200)
+    sw.add_argument("--k", type=int, default=10)
+    sw.add_argument("--target-recall", type=float, default=0.95)
+    sw.add_argument("--methods", default="hnsw,ivfflat")
+
+    args = parser.parse_args()
+
+    with connect() as conn:
+
+        if args.command == "status":
+            status(conn)
+
+        elif args.command == "drop":
+            drop_index(conn)
+
+            if load_settings(conn):
+                conn.execute(f"DELETE FROM {SETTINGS_TABLE} WHERE name = %s", (INDEX_NAME,))
+
+            print(f"Fjernet {INDEX_NAME}")
+
+        elif args.command == "build":
+            warn_unused()
+
+            rows = count_rows(conn)
+
+            if args.method == "hnsw":
+                params = {"m": args.m, "ef_construction": args.ef_construction}
+                value = args.ef_search
+            else:
+                params = {"lists": args.lists or max(1, rows // 1000)}
+                value = args.probes
+
+            seconds = build_index(conn, args.method, params)
+            save_settings(conn, args.method, params, {SEARCH_SETTING[args.method]: value}, rows)
+
+            print(f"Bygget {args.method} {params} på {seconds:.1f}s")
+
+        else:
+            warn_unused()
+            sweep(conn, args.queries, args.k, args.target_recall, args.methods.split(","))
+
+
+if __name__ == "__main__":
+    main()
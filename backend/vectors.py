@@ -0,0 +1,108 @@
+import os
+from typing import List, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# text-embedding-3 can return shorter vectors; truncating a full vector and
+# renormalizing gives the same result, so stored rows can be shrunk later.
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "1536"))
+
+# Column type in Postgres: vector (float32) or halfvec (float16).
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "vector")
+
+# In-process matrices (cache and snapshot): float32, float16 or int8.
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float32")
+
+BLOCK_ROWS = 8192
+
+
+def as_array(value) -> np.ndarray:
+    """A pgvector column value as float32; pgvector 0.5+ returns Vector objects."""
+    if hasattr(value, "to_numpy"):
+        value = value.to_numpy()
+    return np.asarray(value, dtype=np.float32)
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def reduce(matrix: np.ndarray, dimensions: int) -> np.ndarray:
+    return normalize(np.asarray(matrix)[..., :dimensions])
+
+
+class Int8Matrix:
+    """Rows scaled symmetrically to int8, one float32 scale per row."""
+
+    def __init__(self, data: np.ndarray, scale: np.ndarray):
+        self.data = data
+        self.scale = scale
+        self.shape = data.shape
+        self.nbytes = data.nbytes + scale.nbytes
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __matmul__(self, q: np.ndarray) -> np.ndarray:
+        return _blocked_dot(self.data, q) * self.scale
+
+
+def quantize_int8(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    scale = np.abs(matrix).max(axis=-1) / 127
+    scale = np.maximum(scale, 1e-12).astype(np.float32)
+    data = np.rint(matrix / scale[..., None]).astype(np.int8)
+    return data, scale
+
+
+def compact(matrix: np.ndarray, dtype: str = VECTOR_DTYPE):
+    """Normalized float32 rows in the configured in-process precision."""
+    if dtype == "float32":
+        return matrix
+    if dtype == "float16":
+        return matrix.astype(np.float16)
+    if dtype == "int8":
+        return Int8Matrix(*quantize_int8(matrix))
+
+    raise ValueError(f"Unknown VECTOR_DTYPE: {dtype}")
+
+
+def _blocked_dot(matrix: np.ndarray, q: np.ndarray) -> np.ndarray:
+    if matrix.dtype == np.float32:
+        return matrix @ q
+
+    # Upcast a block at a time instead of copying the whole matrix.
+    scores = np.empty(len(matrix), dtype=np.float32)
+
+    for start in range(0, len(matrix), BLOCK_ROWS):
+        block = matrix[start:start + BLOCK_ROWS]
+        scores[start:start + len(block)] = block.astype(np.float32) @ q
+
+    return scores
+
+
+def scores(matrix, q: np.ndarray) -> np.ndarray:
+    if isinstance(matrix, Int8Matrix):
+        return matrix @ q
+    return _blocked_dot(matrix, q)
+
+
+def top_k(matrix, embedding: list, limit: int) -> List[int]:
+    if len(matrix) == 0 or limit <= 0:
+        return []
+
+    # Queries embedded at full size still match a reduced matrix.
+    q = reduce(embedding, matrix.shape[1])
+    s = scores(matrix, q)
+
+    limit = min(limit, len(s))
+    top = np.argpartition(-s, limit - 1)[:limit]
+    top = top[np.argsort(-s[top])]
+
+    return top.tolist()